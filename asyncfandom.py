@@ -0,0 +1,283 @@
+import asyncio
+import contextlib
+import queue
+import random
+import sys
+import threading
+import traceback
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+import aiohttp
+
+from missionparser import parse_mission_record
+from missions import Mission
+from scrapefandom import ScrapeFailure, base_url, is_category_title, missions_category_url, parse_category_page, pool_context
+from timings import timings
+
+_retry_statuses = { 429, 500, 502, 503, 504 }
+
+class HostRateLimiter:
+    def __init__(self, requests_per_second: float):
+        self._interval = 1 / requests_per_second if requests_per_second else 0
+        self._next_slot: dict[str, float] = {}
+
+    async def wait(self, host: str):
+        if not self._interval:
+            return
+        # Reserve the next free slot for this host before sleeping, so
+        # concurrent callers queue up behind each other instead of bursting.
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot.get(host, now))
+        self._next_slot[host] = slot + self._interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+class AsyncFetcher:
+    def __init__(self, *, base_url: str = base_url, max_concurrency=16, per_host_rate=10.0,
+                 retries=3, backoff=0.5, timeout=10, parse_executor: Executor = None):
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._rate_limiter = HostRateLimiter(per_host_rate)
+        self._semaphore: asyncio.Semaphore = None
+        self._session: aiohttp.ClientSession = None
+        self._parse_executor = parse_executor
+        self._owns_parse_executor = parse_executor is None
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=30)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        if self._parse_executor is None:
+            # Not forked, this runs on the event loop's thread
+            self._parse_executor = ProcessPoolExecutor(mp_context=pool_context)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+        if self._owns_parse_executor:
+            self._parse_executor.shutdown(cancel_futures=True)
+            self._parse_executor = None
+
+    def resolve(self, url: str | bytes):
+        if '://' not in url:
+            url = urllib.parse.urljoin(self.base_url, url)
+        return url
+
+    async def fetch(self, url: str | bytes) -> bytes:
+        url = self.resolve(url)
+        host = urllib.parse.urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            retryable = attempt < self.retries
+            async with self._semaphore:
+                await self._rate_limiter.wait(host)
+                try:
+                    async with self._session.get(url) as response:
+                        if not (retryable and response.status in _retry_statuses):
+                            response.raise_for_status()
+                            return await response.read()
+                except aiohttp.ClientResponseError:
+                    raise
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    if not retryable:
+                        raise
+            await asyncio.sleep(self.backoff * 2**attempt * (1 + random.random()))
+
+    async def parse(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._parse_executor, func, *args)
+
+async def scrape_category_page(fetcher: AsyncFetcher, url: str | bytes):
+    return await fetcher.parse(parse_category_page, await fetcher.fetch(url))
+
+async def walk_category(fetcher: AsyncFetcher, url: str | bytes, *, max_depth=2):
+    # Every known category page is fetched concurrently, including the
+    # "next page" of paginated categories, and member pages are yielded as
+    # soon as the category page listing them arrives.
+    seen = { fetcher.resolve(url) }
+    pending: dict[asyncio.Future, int] = {}
+
+    def visit(category_url: str, depth: int):
+        pending[asyncio.ensure_future(scrape_category_page(fetcher, category_url))] = depth
+
+    visit(url, 0)
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                depth = pending.pop(task)
+                links, next_url = task.result()
+                if next_url is not None and fetcher.resolve(next_url) not in seen:
+                    seen.add(fetcher.resolve(next_url))
+                    visit(next_url, depth)
+                for href, title in links.items():
+                    if fetcher.resolve(href) in seen:
+                        continue
+                    if is_category_title(title):
+                        if depth < max_depth:
+                            seen.add(fetcher.resolve(href))
+                            visit(href, depth + 1)
+                    elif depth > 0:
+                        seen.add(fetcher.resolve(href))
+                        yield href, title
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def scrape_subcategory_page_links(fetcher: AsyncFetcher, url: str | bytes, *, max_depth=2):
+    links: OrderedDict[str, str] = OrderedDict()
+    async for href, title in walk_category(fetcher, url, max_depth=max_depth):
+        links[href] = title
+    return links
+
+async def _aislice(iterable, slice_: slice):
+    start, stop, step = slice_.start or 0, slice_.stop, slice_.step or 1
+    if start < 0 or (stop is not None and stop < 0) or step < 1:
+        raise ValueError('slice_ must be non-negative when streaming')
+    async with contextlib.aclosing(iterable):
+        index = 0
+        async for item in iterable:
+            if stop is not None and index >= stop:
+                break
+            if index >= start and (index - start) % step == 0:
+                yield item
+            index += 1
+
+async def scrape_mission_record(fetcher: AsyncFetcher, url: str | bytes):
+    return await fetcher.parse(parse_mission_record, url, await fetcher.fetch(url))
+
+def _attempts(fetcher: AsyncFetcher, error: Exception):
+    # fetch() only gives up on retryable errors once it is out of retries
+    if isinstance(error, aiohttp.ClientResponseError):
+        return fetcher.retries + 1 if error.status in _retry_statuses else 1
+    if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+        return fetcher.retries + 1
+    return 1
+
+async def scrape_all_missions(slice_=slice(None), *, fetcher: AsyncFetcher = None, failures: list[ScrapeFailure] = None, log=False):
+    if fetcher is None:
+        async with AsyncFetcher() as fetcher:
+            async for result in scrape_all_missions(slice_, fetcher=fetcher, failures=failures, log=log):
+                yield result
+        return
+
+    # Mission pages are requested while the category walk is still running.
+    # Finished tasks (the crawl itself and every page) are reported through
+    # a single queue so results are yielded in completion order. A page
+    # that fails is left out and added to failures, like in scrapefandom.
+    finished: asyncio.Queue[asyncio.Future] = asyncio.Queue()
+    tasks: set[asyncio.Future] = set()
+
+    async def scrape(mission_url: str, mission_title: str):
+        try:
+            return mission_url, mission_title, await scrape_mission_record(fetcher, mission_url), None
+        except Exception as e:
+            return mission_url, mission_title, None, e
+
+    async def crawl():
+        async for mission_url, mission_title in _aislice(walk_category(fetcher, missions_category_url), slice_):
+            task = asyncio.ensure_future(scrape(mission_url, mission_title))
+            task.add_done_callback(finished.put_nowait)
+            tasks.add(task)
+
+    crawler = asyncio.ensure_future(crawl())
+    crawler.add_done_callback(finished.put_nowait)
+    crawling = True
+    try:
+        while crawling or tasks:
+            task = await finished.get()
+            if task is crawler:
+                crawler.result()
+                crawling = False
+                continue
+            tasks.discard(task)
+            mission_url, mission_title, record, error = task.result()
+            if error is not None:
+                attempts = _attempts(fetcher, error)
+                print(f"Failed to scrape '{mission_url}' after {attempts} attempts: {type(error).__name__}: {error}", file=sys.stderr)
+                timings.count('scrape_failures')
+                if failures is not None:
+                    failures.append(ScrapeFailure(mission_url, mission_title, f'{type(error).__name__}: {error}', attempts))
+                continue
+            if record is None:
+                continue
+            mission = Mission(mission_url, record=record)
+            if log:
+                try:
+                    print(mission.details())
+                except:
+                    print(f'{traceback.format_exc()}{mission!r}:\n{mission.record}', file=sys.stderr)
+            yield (mission_title, mission)
+    finally:
+        crawler.cancel()
+        for task in tasks:
+            task.cancel()
+
+def iter_all_missions(slice_=slice(None), *, failures: list[ScrapeFailure] = None, max_buffered=64, log=False, **fetcher_options):
+    # Runs the event loop on a background thread so synchronous consumers
+    # such as build_graph can iterate missions as they arrive. At most
+    # max_buffered missions wait for the consumer, after that scraping
+    # pauses. Closing the generator cancels the scrape and waits for the
+    # thread to finish.
+    results = queue.Queue(maxsize=max_buffered)
+    done = object()
+    stopping = threading.Event()
+    producer: dict[str, object] = {}
+
+    def put(item):
+        # Blocks while the queue is full, unless the consumer went away
+        while not stopping.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    async def put_async(item):
+        while not stopping.is_set():
+            try:
+                results.put_nowait(item)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.01)
+
+    async def produce():
+        producer['loop'], producer['task'] = asyncio.get_running_loop(), asyncio.current_task()
+        if stopping.is_set():
+            return
+        async with AsyncFetcher(**fetcher_options) as fetcher:
+            async for result in scrape_all_missions(slice_, fetcher=fetcher, failures=failures, log=log):
+                await put_async(result)
+
+    def run():
+        try:
+            asyncio.run(produce())
+        except asyncio.CancelledError:
+            pass
+        except BaseException as e:
+            put(e)
+        put(done)
+
+    thread = threading.Thread(target=run, name='asyncfandom', daemon=True)
+    thread.start()
+    try:
+        while (result := results.get()) is not done:
+            if isinstance(result, BaseException):
+                raise result
+            yield result
+    finally:
+        stopping.set()
+        if 'task' in producer:
+            with contextlib.suppress(RuntimeError):
+                # The loop is already closed if the scrape had finished
+                producer['loop'].call_soon_threadsafe(producer['task'].cancel)
+        thread.join()
+
+if __name__ == '__main__':
+    for _ in iter_all_missions(log=True):
+        pass
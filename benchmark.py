@@ -0,0 +1,411 @@
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def load_corpus(path: str) -> list[tuple[str, bytes]]:
+    pages = []
+    for directory, _, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            file = os.path.join(directory, filename)
+            with open(file, 'rb') as f:
+                pages.append((os.path.relpath(file, path), f.read()))
+    return pages
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def summarize_times(times: list[float]):
+    ordered = sorted(times)
+    return {
+        'count': len(times),
+        'total_s': sum(times),
+        'mean_ms': statistics.fmean(times) * 1000 if times else 0,
+        'median_ms': statistics.median(times) * 1000 if times else 0,
+        'p95_ms': ordered[int(len(ordered) * 0.95)] * 1000 if times else 0,
+        'max_ms': ordered[-1] * 1000 if times else 0,
+    }
+
+def bench_parse(corpus: str, mode: str):
+    from missionparser import find_infobox
+    pages = load_corpus(corpus)
+    rss_before = peak_rss_mb()
+    times = []
+    found = 0
+    for _, content in pages:
+        start = time.perf_counter()
+        info_box = find_infobox(content, full_parse=mode == 'full')
+        times.append(time.perf_counter() - start)
+        found += info_box is not None
+    return {
+        'mode': mode,
+        'pages': len(pages),
+        'infoboxes': found,
+        'corpus_mb': sum(len(content) for _, content in pages) / 2**20,
+        **summarize_times(times),
+        'peak_rss_mb_before': rss_before,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure_stage(name: str, func, *args, trace_memory=True):
+    if trace_memory:
+        tracemalloc.start()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = func(*args)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    peak_mb = None
+    if trace_memory:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result, {
+        'stage': name,
+        'wall_s': wall,
+        'cpu_s': cpu,
+        'peak_traced_mb': peak_mb,
+    }
+
+def bench_pipeline(snapshot: str, *, trace_memory=True):
+    # Every stage runs on the output of the previous one, so the
+    # stages can be timed separately over the same offline corpus.
+    import missiongraph
+    import scrapefandom
+    from graphcore import GraphCore
+    from missionparser import extract_mission_record, find_infobox
+    from missions import Mission, record_to_json
+    scrapefandom.use_snapshot(snapshot)
+    stages = []
+
+    def stage(name, func, *args):
+        result, measurement = measure_stage(name, func, *args, trace_memory=trace_memory)
+        stages.append(measurement)
+        return result
+
+    def fetch_pages(mission_links):
+        return [ (url, title, request_page(url)) for url, title in mission_links.items() ]
+
+    def request_page(url):
+        response = scrapefandom.session.get(scrapefandom.absolute_url(url))
+        response.raise_for_status()
+        return response.content
+
+    def parse_pages(pages):
+        return [ (url, title, find_infobox(content)) for url, title, content in pages ]
+
+    def extract_missions(infoboxes):
+        return [ (title, Mission(url, record=extract_mission_record(url, info_box)))
+                 for url, title, info_box in infoboxes if info_box is not None ]
+
+    def size_and_make_network(core):
+        # What make_graph_network does after the reduction
+        missiongraph.size_core_by_degree(core)
+        return missiongraph.make_network(core)
+
+    mission_links = stage('category_crawl', scrapefandom.scrape_subcategory_page_links, scrapefandom.missions_category_url)
+    stages[-1]['items'] = len(mission_links)
+    pages = stage('page_fetch', fetch_pages, mission_links)
+    stages[-1]['items'] = len(pages)
+    stages[-1]['bytes'] = sum(len(content) for _, _, content in pages)
+    infoboxes = stage('page_parse', parse_pages, pages)
+    stages[-1]['items'] = sum(info_box is not None for _, _, info_box in infoboxes)
+    missions = stage('mission_extraction', extract_missions, infoboxes)
+    stages[-1]['items'] = len(missions)
+    stages[-1]['bytes'] = sum(len(record_to_json(mission.record).encode()) for _, mission in missions)
+    graph = stage('build_graph', missiongraph.build_graph, False, missions)
+    stages[-1]['items'] = graph.number_of_nodes() + graph.number_of_edges()
+    core = stage('graph_core', GraphCore.from_nx, graph)
+    stages[-1]['items'] = len(core) + core.number_of_edges()
+    reduced_core = stage('transitive_reduction', missiongraph.reduce_core, core)
+    stages[-1]['items'] = len(reduced_core) + reduced_core.number_of_edges()
+    net = stage('network_export', size_and_make_network, reduced_core)
+    stages[-1]['items'] = net.num_nodes() + net.num_edges()
+    html = stage('html_generation', missiongraph.render_html, net)
+    stages[-1]['bytes'] = len(html.encode())
+
+    return {
+        'revision': _git_revision(),
+        'python': sys.version.split()[0],
+        'snapshot': os.path.abspath(snapshot),
+        'total_wall_s': sum(stage['wall_s'] for stage in stages),
+        'total_cpu_s': sum(stage['cpu_s'] for stage in stages),
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': stages,
+    }
+
+def _snapshot_infoboxes(snapshot: str):
+    import scrapefandom
+    from missionparser import find_infobox
+    scrapefandom.use_snapshot(snapshot)
+    mission_links = scrapefandom.scrape_subcategory_page_links(scrapefandom.missions_category_url)
+    infoboxes = []
+    for url, title in mission_links.items():
+        response = scrapefandom.session.get(scrapefandom.absolute_url(url))
+        response.raise_for_status()
+        info_box = find_infobox(response.content)
+        if info_box is not None:
+            infoboxes.append((url, title, info_box))
+    return infoboxes
+
+def bench_entries(snapshot: str, *, repeat=5):
+    # Prerequisite and reward handling over every mission in the snapshot,
+    # the best of a few runs as these are short enough for timer noise to show
+    from missionparser import extract_mission_record
+    from missions import Mission
+    infoboxes = [ (url, info_box) for url, _, info_box in _snapshot_infoboxes(snapshot) ]
+
+    def extract_records():
+        return [ extract_mission_record(url, info_box) for url, info_box in infoboxes ]
+
+    def access_entries(records):
+        # The attributes build_graph reads, as often as it reads them
+        reads = 0
+        for record in records:
+            mission = Mission(record.href, record=record)
+            for _ in range(2):
+                for prereq in mission.prereqs:
+                    reads += bool(prereq.is_mission) + bool(prereq.href) + bool(prereq.title) + bool(prereq.is_affinity)
+            for reward in mission.rewards:
+                if reward.unlocks_recruits:
+                    reads += len(reward.recruits)
+        return reads
+
+    def best(func, *args):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func(*args)
+            times.append(time.perf_counter() - start)
+        return result, min(times)
+
+    records, extract_s = best(extract_records)
+    entries = sum(len(record.prereqs) + len(record.rewards) for record in records)
+    _, access_s = best(access_entries, records)
+    return {
+        'revision': _git_revision(),
+        'missions': len(records),
+        'entries': entries,
+        'stages': [
+            { 'stage': 'record_extraction', 'best_ms': extract_s * 1000, 'per_entry_us': extract_s / entries * 1e6 },
+            { 'stage': 'entry_access', 'best_ms': access_s * 1000, 'per_entry_us': access_s / entries * 1e6 },
+        ],
+    }
+
+def bench_core(snapshot: str, *, repeat=5):
+    # Reduction, degree sizing and pyvis export on networkx dicts against
+    # the same steps on a GraphCore, including the conversion to it
+    import missiongraph
+    from graphcore import GraphCore
+    from missionparser import extract_mission_record
+    from missions import Mission
+    graph = missiongraph.build_graph(source=[ (title, Mission(url, record=extract_mission_record(url, info_box)))
+                                              for url, title, info_box in _snapshot_infoboxes(snapshot) ])
+
+    def networkx_path():
+        reduced = missiongraph.reduce_graph(graph)
+        missiongraph.size_nodes_by_degree(reduced)
+        return missiongraph.make_network(reduced)
+
+    def core_path():
+        core = missiongraph.reduce_core(GraphCore.from_nx(graph))
+        missiongraph.size_core_by_degree(core)
+        return missiongraph.make_network(core)
+
+    def attributes_copy():
+        # What holding the graph costs besides the attribute values themselves
+        return graph.copy()
+
+    stages = []
+    for name, func in [('networkx', networkx_path), ('graph_core', core_path),
+                       ('networkx_graph', attributes_copy), ('graph_core_graph', lambda: GraphCore.from_nx(graph))]:
+        wall = min(measure_stage(name, func, trace_memory=False)[1]['wall_s'] for _ in range(repeat))
+        _, measurement = measure_stage(name, func)
+        stages.append({ 'stage': name, 'wall_ms': wall * 1000, 'peak_traced_mb': measurement['peak_traced_mb'] })
+    return {
+        'revision': _git_revision(),
+        'nodes': graph.number_of_nodes(),
+        'edges': graph.number_of_edges(),
+        'stages': stages,
+    }
+
+def bench_cache(snapshot: str, workers: list[int], *, chunksize=8, latency=0.0, limit: int = None):
+    # Cold scrapes through the HTTP cache, with the snapshot served over
+    # HTTP as the wiki, at several max_workers. Every worker writes its
+    # responses to the shared cache, 'cached' shows none of them were lost.
+    import sqlite3
+    import tempfile
+    import threading
+    import scrapefandom
+    from httpcache import CachePolicy, default_cache_path
+    from snapshot import serve_snapshot
+    from timings import timings
+    scrapefandom.use_snapshot(snapshot)
+    mission_links = scrapefandom.scrape_subcategory_page_links(scrapefandom.missions_category_url)
+    del os.environ['XCX_SNAPSHOT']
+
+    server = serve_snapshot(snapshot, port=0, latency=latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    origin = f'http://127.0.0.1:{server.server_port}'
+    links = [ (origin + url, title) for url, title in mission_links.items() ][:limit]
+
+    runs = []
+    cwd = os.getcwd()
+    try:
+        for max_workers in workers:
+            with tempfile.TemporaryDirectory() as directory:
+                os.chdir(directory)
+                scrapefandom.use_cache_policy(CachePolicy())
+                timings.counters.clear()
+                start = time.perf_counter()
+                pages = sum(1 for _ in scrapefandom._scrape_mission_records_concurrent(
+                    links, max_workers=max_workers, chunksize=chunksize))
+                wall = time.perf_counter() - start
+                scrapefandom.session.close()
+                with contextlib.closing(sqlite3.connect(f'{default_cache_path}.sqlite')) as connection:
+                    cached, = connection.execute('SELECT count(*) FROM responses').fetchone()
+                os.chdir(cwd)
+            runs.append({
+                'max_workers': max_workers,
+                'pages': pages,
+                'cached': cached,
+                'wall_s': wall,
+                'pages_per_s': pages / wall,
+                'misses': timings.counters.get('http_cache_misses', 0),
+            })
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+    return {
+        'revision': _git_revision(),
+        'cpus': os.cpu_count(),
+        'latency_ms': latency * 1000,
+        'runs': runs,
+    }
+
+def compare_results(baseline: dict, current: dict):
+    baseline_stages = { stage['stage']: stage for stage in baseline['stages'] }
+    rows = []
+    for stage in current['stages']:
+        before = baseline_stages.get(stage['stage'])
+        if before is None:
+            continue
+        rows.append({
+            'stage': stage['stage'],
+            'before_s': before['wall_s'],
+            'after_s': stage['wall_s'],
+            'ratio': stage['wall_s'] / before['wall_s'] if before['wall_s'] else float('inf'),
+        })
+    return rows
+
+def _run_isolated(*args: str):
+    # Each measurement gets a fresh interpreter so peak RSS is not shared
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), *args, '--isolated'],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output)
+
+def _print_table(results: list[dict], columns: list[str]):
+    widths = [ max(len(column), *(len(_format(result.get(column))) for result in results)) for column in columns ]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)), file=sys.stderr)
+    for result in results:
+        print('  '.join(_format(result.get(column)).ljust(width) for column, width in zip(columns, widths)), file=sys.stderr)
+
+def _format(value):
+    if isinstance(value, float):
+        return f'{value:.2f}'
+    return str(value)
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Benchmarks for the mission scraper and graph builder')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parse = commands.add_parser('parse', help='time infobox parsing over a directory of saved wiki pages')
+    parse.add_argument('corpus', help='directory of saved mission pages')
+    parse.add_argument('--mode', choices=['full', 'fast', 'both'], default='both',
+                       help="'full' parses the whole page with bs4, 'fast' only the infobox")
+    parse.add_argument('--isolated', action='store_true', help=argparse.SUPPRESS)
+
+    pipeline = commands.add_parser('pipeline', help='time every stage from category crawl to HTML over a snapshot')
+    pipeline.add_argument('snapshot', help='snapshot made with snapshot.py')
+    pipeline.add_argument('--output', '-o', help='also write the JSON report to this file')
+    pipeline.add_argument('--no-memory', action='store_true',
+                          help='skip tracemalloc, which slows the stages down noticeably')
+
+    entries = commands.add_parser('entries', help='time prerequisite and reward parsing over every mission in a snapshot')
+    entries.add_argument('snapshot', help='snapshot made with snapshot.py')
+    entries.add_argument('--repeat', type=int, default=5)
+
+    core = commands.add_parser('core', help='compare the networkx and GraphCore paths from graph to pyvis network')
+    core.add_argument('snapshot', help='snapshot made with snapshot.py')
+    core.add_argument('--repeat', type=int, default=5)
+
+    cache = commands.add_parser('cache', help='scrape throughput through the HTTP cache against max_workers')
+    cache.add_argument('snapshot', help='snapshot made with snapshot.py, served over HTTP as the wiki')
+    cache.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    cache.add_argument('--chunksize', type=int, default=8)
+    cache.add_argument('--latency-ms', type=float, default=0, help='delay every response by this much')
+    cache.add_argument('--limit', type=int, help='only scrape this many missions')
+
+    compare = commands.add_parser('compare', help='compare two pipeline reports stage by stage')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+
+    args = parser.parse_args(argv)
+    if args.command == 'pipeline':
+        result = bench_pipeline(args.snapshot, trace_memory=not args.no_memory)
+        _print_table(result['stages'], ['stage', 'wall_s', 'cpu_s', 'peak_traced_mb', 'items', 'bytes'])
+        report = json.dumps(result, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf8') as out:
+                out.write(report)
+        print(report)
+    elif args.command == 'entries':
+        result = bench_entries(args.snapshot, repeat=args.repeat)
+        _print_table(result['stages'], ['stage', 'best_ms', 'per_entry_us'])
+        print(json.dumps(result, indent=2))
+    elif args.command == 'core':
+        result = bench_core(args.snapshot, repeat=args.repeat)
+        _print_table(result['stages'], ['stage', 'wall_ms', 'peak_traced_mb'])
+        print(json.dumps(result, indent=2))
+    elif args.command == 'cache':
+        result = bench_cache(args.snapshot, args.workers, chunksize=args.chunksize,
+                             latency=args.latency_ms / 1000, limit=args.limit)
+        _print_table(result['runs'], ['max_workers', 'pages', 'cached', 'wall_s', 'pages_per_s'])
+        print(json.dumps(result, indent=2))
+    elif args.command == 'compare':
+        with open(args.baseline, encoding='utf8') as baseline, open(args.current, encoding='utf8') as current:
+            rows = compare_results(json.load(baseline), json.load(current))
+        _print_table(rows, ['stage', 'before_s', 'after_s', 'ratio'])
+        print(json.dumps(rows, indent=2))
+    elif args.command == 'parse':
+        if args.isolated:
+            print(json.dumps(bench_parse(args.corpus, args.mode)))
+            return
+        modes = ['full', 'fast'] if args.mode == 'both' else [args.mode]
+        results = [ _run_isolated('parse', args.corpus, '--mode', mode) for mode in modes ]
+        _print_table(results, ['mode', 'pages', 'infoboxes', 'mean_ms', 'median_ms', 'p95_ms', 'total_s', 'peak_rss_mb'])
+        print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
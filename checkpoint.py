@@ -0,0 +1,97 @@
+import json
+import os
+from dataclasses import asdict
+from typing import NamedTuple
+
+from missions import MissionRecord, record_from_dict
+from missionstore import extraction_version
+
+default_checkpoint_path = '.scrape_checkpoint.jsonl'
+
+class CheckpointEntry(NamedTuple):
+    url: str
+    title: str
+    body_hash: str | None
+    record: MissionRecord | None
+    # The wiki revision the record was scraped from, if the scrape knew it
+    revision_id: int | None = None
+
+class ScrapeCheckpoint:
+    # Every finished page is appended as one JSON line and flushed right
+    # away, so an interrupted scrape loses at most the line being written
+    # and the next run picks up the rest. The first line holds the
+    # extraction version, records from other versions are not reused.
+    # Only an interrupted scrape leaves its checkpoint behind, a finished
+    # one removes it even if some pages failed.
+    def __init__(self, path=default_checkpoint_path):
+        self.path = path
+        self.entries: dict[str, CheckpointEntry] = {}
+        version = extraction_version()
+        valid = self._load(version)
+        self._file = open(path, 'a' if valid else 'w', encoding='utf8')
+        if not valid:
+            self._write({ 'version': version })
+
+    def _load(self, version: str):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding='utf8') as file:
+            text = file.read()
+        lines = text.splitlines()
+        try:
+            if json.loads(lines[0]).get('version') != version:
+                return False
+        except (IndexError, ValueError, AttributeError):
+            return False
+        for line in lines[1:]:
+            try:
+                value = json.loads(line)
+            except ValueError:
+                # Cut off by the interruption
+                continue
+            record = record_from_dict(value['record']) if value['record'] is not None else None
+            self.entries[value['url']] = CheckpointEntry(value['url'], value['title'], value['body_hash'], record,
+                                                         value.get('revision_id'))
+        if not text.endswith('\n'):
+            with open(self.path, 'a', encoding='utf8') as file:
+                file.write('\n')
+        return True
+
+    def _write(self, value: dict):
+        self._file.write(json.dumps(value, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, url: str) -> CheckpointEntry | None:
+        return self.entries.get(url)
+
+    def add(self, url: str, title: str, body_hash: str | None, record: MissionRecord | None,
+            revision_id: int | None = None):
+        # Only written, a run never asks for a page it finished itself, so
+        # memory stays at what was loaded to resume
+        self._write({
+            'url': url,
+            'title': title,
+            'body_hash': body_hash,
+            'record': asdict(record) if record is not None else None,
+            'revision_id': revision_id,
+        })
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def remove(self):
+        # Once a scrape finished, the next one starts from scratch, otherwise
+        # every later run would keep serving the pages it holds
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,200 @@
+import networkx as nx
+import numpy as np
+
+from graphreduce import redundant_edges
+
+class _Columns:
+    # Attributes of many nodes or edges: one column per attribute name, and
+    # per row the index of its schema, the names it has in their dict order.
+    # Columns that only hold strings are int32 codes into a shared string table.
+    def __init__(self, rows: int, strings: list[str], string_codes: dict[str, int]):
+        self.rows = rows
+        self.strings = strings
+        self.string_codes = string_codes
+        self.schemas: list[tuple[str, ...]] = []
+        self.schema_ids: dict[tuple[str, ...], int] = {}
+        self.schema = np.zeros(rows, dtype=np.int32)
+        self.columns: dict[str, np.ndarray] = {}
+        self._values: dict[str, list] = {}
+
+    def _schema_id(self, keys: tuple[str, ...]):
+        schema_id = self.schema_ids.get(keys)
+        if schema_id is None:
+            schema_id = self.schema_ids[keys] = len(self.schemas)
+            self.schemas.append(keys)
+        return schema_id
+
+    def add(self, row: int, data: dict):
+        self.schema[row] = self._schema_id(tuple(data))
+        for key, value in data.items():
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [None] * self.rows
+            values[row] = value
+
+    def finish(self):
+        for key, values in self._values.items():
+            self.columns[key] = self._encode(values)
+        self._values.clear()
+        return self
+
+    def _encode(self, values: list):
+        if all(value is None or type(value) is str for value in values):
+            codes = np.empty(len(values), dtype=np.int32)
+            for row, value in enumerate(values):
+                if value is None:
+                    codes[row] = -1
+                    continue
+                code = self.string_codes.get(value)
+                if code is None:
+                    code = self.string_codes[value] = len(self.strings)
+                    self.strings.append(value)
+                codes[row] = code
+            return codes
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        return column
+
+    def value(self, key: str, row: int):
+        column = self.columns[key]
+        if column.dtype == object:
+            return column[row]
+        code = column[row]
+        return self.strings[code] if code >= 0 else None
+
+    def row(self, row: int) -> dict:
+        return { key: self.value(key, row) for key in self.schemas[self.schema[row]] }
+
+    def has(self, key: str) -> np.ndarray:
+        if key not in self.columns:
+            return np.zeros(self.rows, dtype=bool)
+        return np.array([ key in schema for schema in self.schemas ], dtype=bool)[self.schema]
+
+    def select(self, rows: np.ndarray):
+        selected = _Columns(len(self.schema[rows]), self.strings, self.string_codes)
+        selected.schemas = [*self.schemas]
+        selected.schema_ids = dict(self.schema_ids)
+        selected.schema = self.schema[rows]
+        selected.columns = { key: column[rows] for key, column in self.columns.items() }
+        return selected
+
+    def copy(self):
+        # Columns are replaced by set(), never written to, so views will do
+        return self.select(slice(None))
+
+    def set(self, key: str, values):
+        # Like setting the key in every row's dict: rows that already had it
+        # keep it in place, the others get it last
+        schemas = [ schema if key in schema else schema + (key,) for schema in self.schemas ]
+        remap = np.array([ self._schema_id(schema) for schema in schemas ], dtype=np.int32)
+        self.schema = remap[self.schema] if len(remap) else self.schema
+        self.columns[key] = self._encode(list(values))
+
+class GraphCore:
+    # A directed graph with nodes numbered 0..n-1 and its edges in CSR form:
+    # the successors of node i are targets[offsets[i]:offsets[i+1]], in the
+    # order networkx would list them. Attributes live in columns instead of
+    # a dict per node and per edge.
+    def __init__(self, nodes: list[str], offsets: np.ndarray, targets: np.ndarray,
+                 node_attributes: _Columns, edge_attributes: _Columns, attributes: dict = None):
+        self.nodes = nodes
+        self.offsets = offsets
+        self.targets = targets
+        self.node_attributes = node_attributes
+        self.edge_attributes = edge_attributes
+        self.attributes = attributes or {}
+
+    @classmethod
+    def from_nx(cls, graph: nx.DiGraph):
+        nodes = [*graph]
+        index = { node: i for i, node in enumerate(nodes) }
+        strings, string_codes = [], {}
+        node_attributes = _Columns(len(nodes), strings, string_codes)
+        for i, data in enumerate(graph.nodes.values()):
+            node_attributes.add(i, data)
+
+        edge_attributes = _Columns(graph.number_of_edges(), strings, string_codes)
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int32)
+        targets = np.empty(graph.number_of_edges(), dtype=np.int32)
+        edge = 0
+        for i, (_, adjacency) in enumerate(graph.adjacency()):
+            for v, data in adjacency.items():
+                targets[edge] = index[v]
+                edge_attributes.add(edge, data)
+                edge += 1
+            offsets[i + 1] = edge
+        return cls(nodes, offsets, targets, node_attributes.finish(), edge_attributes.finish(), dict(graph.graph))
+
+    def to_nx(self) -> nx.DiGraph:
+        graph = nx.DiGraph()
+        graph.graph.update(self.attributes)
+        graph.add_nodes_from((node, self.node_attributes.row(i)) for i, node in enumerate(self.nodes))
+        sources = self.sources()
+        graph.add_edges_from((self.nodes[sources[edge]], self.nodes[self.targets[edge]], self.edge_attributes.row(edge))
+                             for edge in range(len(self.targets)))
+        return graph
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return len(self.targets)
+
+    def sources(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self.nodes), dtype=np.int32), np.diff(self.offsets))
+
+    def out_degree(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def in_degree(self) -> np.ndarray:
+        return np.bincount(self.targets, minlength=len(self.nodes))
+
+    def successors(self) -> list[list[int]]:
+        targets = self.targets.tolist()
+        offsets = self.offsets.tolist()
+        return [ targets[offsets[i]:offsets[i+1]] for i in range(len(self.nodes)) ]
+
+    def select_edges(self, mask: np.ndarray) -> 'GraphCore':
+        rows = np.flatnonzero(mask)
+        offsets = np.zeros(len(self.nodes) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(self.sources()[rows], minlength=len(self.nodes)), out=offsets[1:])
+        return GraphCore(self.nodes, offsets, self.targets[rows], self.node_attributes.copy(),
+                         self.edge_attributes.select(rows), dict(self.attributes))
+
+    def transitive_reduction(self, keep: np.ndarray = None) -> 'GraphCore':
+        # Same as graphreduce.transitive_reduction, with keep as a mask over the edges
+        redundant = np.array(redundant_edges(self.successors()), dtype=bool)
+        if keep is not None:
+            redundant &= ~keep
+        return self.select_edges(~redundant)
+
+    def to_network(self, net, default_node_size=10):
+        # What Network.from_nx makes of the equivalent networkx graph: nodes
+        # in the order their first edge mentions them, then the isolated
+        # ones. Each node is added once instead of once per edge, which is
+        # where from_nx spends its time searching the node list.
+        sources = self.sources().tolist()
+        targets = self.targets.tolist()
+        sizes = self.node_attributes.has('size')
+        order: dict[int, bool] = {}
+        for u, v in zip(sources, targets):
+            order.setdefault(u, True)
+            order.setdefault(v, True)
+        isolated = (self.out_degree() == 0) & (self.in_degree() == 0)
+        for i in np.flatnonzero(isolated).tolist():
+            order.setdefault(i, False)
+
+        for i, convert_size in order.items():
+            data = self.node_attributes.row(i)
+            if not sizes[i]:
+                data['size'] = default_node_size
+            if convert_size:
+                data['size'] = int(data['size'])
+            net.add_node(self.nodes[i], **data)
+
+        for edge, (u, v) in enumerate(zip(sources, targets)):
+            data = self.edge_attributes.row(edge)
+            if 'value' not in data or 'width' not in data:
+                data['width'] = data.pop('weight', 1)
+            net.add_edge(self.nodes[u], self.nodes[v], **data)
+        return net
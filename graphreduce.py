@@ -0,0 +1,94 @@
+from typing import Callable
+import networkx as nx
+
+def condense(successors: list[list[int]]):
+    # Tarjan's strongly connected components, iterative so deep chains of
+    # missions don't hit the recursion limit. Components come out in reverse
+    # topological order, i.e. every component after the ones it points to.
+    count = len(successors)
+    index = [-1] * count
+    lowlink = [0] * count
+    on_stack = [False] * count
+    stack: list[int] = []
+    component = [-1] * count
+    components = 0
+    counter = 0
+    for root in range(count):
+        if index[root] != -1:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, i = work.pop()
+            if i == 0:
+                index[node] = lowlink[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+            recursed = False
+            for j in range(i, len(successors[node])):
+                successor = successors[node][j]
+                if index[successor] == -1:
+                    work.append((node, j + 1))
+                    work.append((successor, 0))
+                    recursed = True
+                    break
+                if on_stack[successor]:
+                    lowlink[node] = min(lowlink[node], index[successor])
+            if recursed:
+                continue
+            if lowlink[node] == index[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component[member] = components
+                    if member == node:
+                        break
+                components += 1
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+    return component, components
+
+def redundant_edges(successors: list[list[int]]) -> list[bool]:
+    # For every edge, in the order of successors, whether another path
+    # between its ends makes it redundant. Edges inside a cycle never are,
+    # the rest of the graph is reduced as if each cycle were a single node.
+    component, components = condense(successors)
+
+    # Reachability between components as bitsets, filled in reverse
+    # topological order so each component's successors are already done
+    component_successors: list[set[int]] = [ set() for _ in range(components) ]
+    for u, targets in enumerate(successors):
+        for v in targets:
+            if component[u] != component[v]:
+                component_successors[component[u]].add(component[v])
+    reachable = [0] * components
+    # Components reachable through a path of length two or more
+    indirect = [0] * components
+    for c in range(components):
+        for s in component_successors[c]:
+            indirect[c] |= reachable[s]
+        reachable[c] = indirect[c]
+        for s in component_successors[c]:
+            reachable[c] |= 1 << s
+
+    return [ component[u] != component[v] and bool(indirect[component[u]] >> component[v] & 1)
+             for u, targets in enumerate(successors) for v in targets ]
+
+def transitive_reduction(graph: nx.DiGraph, keep: Callable[[str, str, dict], bool] = None) -> nx.DiGraph:
+    # Same result as nx.transitive_reduction, but every node and edge keeps
+    # its attributes, edges for which keep(u, v, data) is true are never
+    # removed, and cycles don't raise.
+    nodes = [*graph]
+    index = { node: i for i, node in enumerate(nodes) }
+    successors = [ [ index[v] for v in graph.successors(node) ] for node in nodes ]
+    redundant = redundant_edges(successors)
+
+    reduced = nx.DiGraph()
+    reduced.graph.update(graph.graph)
+    reduced.add_nodes_from(graph.nodes.data())
+    # graph.edges.data() yields the edges in the same order as successors
+    for (u, v, data), is_redundant in zip(graph.edges.data(), redundant):
+        if not is_redundant or (keep is not None and keep(u, v, data)):
+            reduced.add_edge(u, v, **data)
+    return reduced
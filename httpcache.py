@@ -0,0 +1,201 @@
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from dataclasses import asdict, dataclass
+import requests_cache
+
+default_cache_path = '.requests_cache'
+
+@dataclass(frozen=True)
+class CachePolicy:
+    # Seconds a response is used without asking the wiki again. After that
+    # it is revalidated with If-None-Match/If-Modified-Since, so an
+    # unchanged page costs a 304 instead of the whole page.
+    category_ttl: float = 6 * 60 * 60
+    page_ttl: float = 7 * 24 * 60 * 60
+    api_ttl: float = 60 * 60
+    # Least recently used responses are evicted above this size
+    max_size_mb: float = 1024
+    # The file is compacted after this long, or when a quarter of it is free pages
+    vacuum_interval: float = 7 * 24 * 60 * 60
+
+    def urls_expire_after(self):
+        # First match wins
+        return {
+            '*/wiki/Category:*': self.category_ttl,
+            '*/api.php*': self.api_ttl,
+            '*/wiki/*': self.page_ttl,
+        }
+
+    def to_json(self):
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, text: str):
+        return cls(**json.loads(text))
+
+class PolicySession(requests_cache.CachedSession):
+    # A CachedSession that remembers when each response was last used, for
+    # LRU eviction. Access times are kept in memory and written in one
+    # transaction by record_access(), which pool workers leave to the parent.
+    def __init__(self, cache_path=default_cache_path, policy: CachePolicy = CachePolicy(), **kwargs):
+        super().__init__(
+            cache_path,
+            expire_after=policy.page_ttl,
+            urls_expire_after=policy.urls_expire_after(),
+            stale_if_error=True,
+            # Pool workers write their responses themselves, WAL lets the
+            # others keep reading meanwhile and writers queue up instead of
+            # failing with "database is locked"
+            wal=True,
+            busy_timeout=30_000,
+            **kwargs,
+        )
+        self.policy = policy
+        self.accessed: dict[str, float] = {}
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        self.accessed[self.cache.create_key(request, **kwargs)] = time.time()
+        return response
+
+    def take_accessed(self):
+        accessed, self.accessed = self.accessed, {}
+        return accessed
+
+    def record_access(self, accessed: dict[str, float] = None):
+        accessed = { **self.take_accessed(), **(accessed or {}) }
+        if not accessed:
+            return
+        with _connect(self.cache.responses.db_path) as connection:
+            connection.executemany(
+                'INSERT INTO cache_access (key, accessed) VALUES (?, ?)'
+                ' ON CONFLICT(key) DO UPDATE SET accessed = max(accessed, excluded.accessed)',
+                accessed.items())
+
+    def maintain(self):
+        self.record_access()
+        return maintain_cache(self.cache.responses.db_path, self.policy)
+
+def take_accessed(session):
+    # Sessions without a cache policy, e.g. snapshot replays, have nothing to report
+    return session.take_accessed() if isinstance(session, PolicySession) else {}
+
+def merge_accessed(session, accessed: dict[str, float]):
+    # Access times sent back by pool workers, written with the parent's own
+    if isinstance(session, PolicySession):
+        for key, accessed_at in accessed.items():
+            session.accessed[key] = max(accessed_at, session.accessed.get(key, 0))
+
+@contextlib.contextmanager
+def _connect(db_path: str):
+    # The access times live next to requests_cache's own tables
+    connection = sqlite3.connect(db_path, timeout=30)
+    try:
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS cache_access (key TEXT PRIMARY KEY, accessed REAL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value REAL)')
+            yield connection
+    finally:
+        connection.close()
+
+def _db_path(path: str | os.PathLike):
+    path = os.fspath(path)
+    return path if path.endswith('.sqlite') else path + '.sqlite'
+
+def cache_stats(path=default_cache_path):
+    db_path = _db_path(path)
+    if not os.path.exists(db_path):
+        return None
+    with _connect(db_path) as connection:
+        entries, payload_bytes = connection.execute('SELECT count(*), coalesce(sum(length(value)), 0) FROM responses').fetchone()
+        expired, = connection.execute('SELECT count(*) FROM responses WHERE expires IS NOT NULL AND expires <= ?',
+                                      (time.time(),)).fetchone()
+        never_accessed, = connection.execute(
+            'SELECT count(*) FROM responses WHERE key NOT IN (SELECT key FROM cache_access)').fetchone()
+        page_count, = connection.execute('PRAGMA page_count').fetchone()
+        freelist_count, = connection.execute('PRAGMA freelist_count').fetchone()
+        last_vacuum = connection.execute("SELECT value FROM cache_meta WHERE key = 'last_vacuum'").fetchone()
+    return {
+        'entries': entries,
+        'expired': expired,
+        'never_accessed': never_accessed,
+        'payload_mb': payload_bytes / 2**20,
+        'file_mb': os.path.getsize(db_path) / 2**20,
+        'free_pages': freelist_count,
+        'pages': page_count,
+        'last_vacuum': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_vacuum[0])) if last_vacuum else None,
+    }
+
+def maintain_cache(path=default_cache_path, policy: CachePolicy = CachePolicy(), *, vacuum: bool = None):
+    # Evicts least recently used responses down to the size cap, then
+    # compacts the file if it's due. Responses that were never used since
+    # access tracking started count as the oldest.
+    db_path = _db_path(path)
+    if not os.path.exists(db_path):
+        return { 'evicted': 0, 'vacuumed': False }
+    max_bytes = policy.max_size_mb * 2**20
+    evicted = 0
+    with _connect(db_path) as connection:
+        total, = connection.execute('SELECT coalesce(sum(length(value)), 0) FROM responses').fetchone()
+        if total > max_bytes:
+            # Evict down to 90% so the cap isn't hit again by the next few pages
+            rows = connection.execute(
+                'SELECT responses.key, length(responses.value) FROM responses'
+                ' LEFT JOIN cache_access ON cache_access.key = responses.key'
+                ' ORDER BY coalesce(cache_access.accessed, 0), responses.expires').fetchall()
+            doomed = []
+            for key, size in rows:
+                if total <= max_bytes * 0.9:
+                    break
+                doomed.append((key,))
+                total -= size
+            connection.executemany('DELETE FROM responses WHERE key = ?', doomed)
+            connection.executemany('DELETE FROM cache_access WHERE key = ?', doomed)
+            # Redirect aliases pointing at evicted responses
+            connection.execute('DELETE FROM redirects WHERE value NOT IN (SELECT key FROM responses)')
+            evicted = len(doomed)
+        connection.execute('DELETE FROM cache_access WHERE key NOT IN (SELECT key FROM responses)')
+
+        page_count, = connection.execute('PRAGMA page_count').fetchone()
+        freelist_count, = connection.execute('PRAGMA freelist_count').fetchone()
+        last_vacuum = connection.execute("SELECT value FROM cache_meta WHERE key = 'last_vacuum'").fetchone()
+        if vacuum is None:
+            vacuum = (freelist_count > page_count / 4
+                      or last_vacuum is None or time.time() - last_vacuum[0] > policy.vacuum_interval)
+        if vacuum:
+            connection.execute("INSERT OR REPLACE INTO cache_meta (key, value) VALUES ('last_vacuum', ?)", (time.time(),))
+    if vacuum:
+        connection = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        try:
+            connection.execute('VACUUM')
+        finally:
+            connection.close()
+    return { 'evicted': evicted, 'vacuumed': vacuum }
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Inspect and maintain the scraper's HTTP cache")
+    parser.add_argument('--cache', default=default_cache_path, help='requests_cache database, without .sqlite')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help='entries, expired entries and sizes')
+    maintain = commands.add_parser('maintain', help='evict least recently used responses and compact the file')
+    maintain.add_argument('--max-size-mb', type=float, default=CachePolicy.max_size_mb)
+    maintain.add_argument('--vacuum', action=argparse.BooleanOptionalAction, default=None,
+                          help='compact the file even if it isn\'t due, or never')
+    args = parser.parse_args(argv)
+
+    if args.command == 'maintain':
+        result = maintain_cache(args.cache, CachePolicy(max_size_mb=args.max_size_mb), vacuum=args.vacuum)
+        print(f"Evicted {result['evicted']} responses{', compacted' if result['vacuumed'] else ''}", file=sys.stderr)
+    stats = cache_stats(args.cache)
+    if stats is None:
+        parser.error(f"no cache at '{_db_path(args.cache)}'")
+    for key, value in stats.items():
+        print(f'{key:16}{value:.1f}' if isinstance(value, float) else f'{key:16}{value}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import networkx as nx
+import numpy as np
+
+layout_seed = 2015_04_25
+
+def force_layout(graph: nx.DiGraph, *, iterations=300, spring_length=95, seed=layout_seed):
+    # A force directed layout in the spirit of vis-network's own solver:
+    # every pair of nodes repels, edges pull like springs of their 'length'.
+    # Nodes with a preset 'x' (the story chapters) keep it and only move
+    # vertically, so the chapter columns stay where build_graph put them.
+    # Sorted, because node and edge order depend on set iteration (and so
+    # on hash randomization) in the transitive reduction
+    nodes = sorted(graph.nodes)
+    index = { node: i for i, node in enumerate(nodes) }
+    count = len(nodes)
+    if count == 0:
+        return {}
+    rng = np.random.default_rng(seed)
+
+    anchored = np.array([ 'x' in graph.nodes[node] for node in nodes ])
+    anchor_x = np.array([ graph.nodes[node].get('x', 0) for node in nodes ], dtype=float)
+    spread = spring_length * np.sqrt(count)
+    positions = rng.uniform(-spread / 2, spread / 2, (count, 2))
+    positions[anchored, 0] = anchor_x[anchored]
+
+    edges = sorted([ (index[u], index[v], data.get('length', spring_length)) for u, v, data in graph.edges.data() if u != v ])
+    sources = np.array([ u for u, _, _ in edges ], dtype=int)
+    targets = np.array([ v for _, v, _ in edges ], dtype=int)
+    lengths = np.array([ length for _, _, length in edges ], dtype=float)
+
+    temperature = spread / 10
+    for step in range(iterations):
+        dx = positions[:, 0, None] - positions[None, :, 0]
+        dy = positions[:, 1, None] - positions[None, :, 1]
+        # Repulsion falls off with distance, k^2/d as in Fruchterman-Reingold
+        # (dividing the unnormalized delta by d^2 gives the 1/d magnitude)
+        repulsion = spring_length**2 / np.maximum(dx * dx + dy * dy, 1.0)
+        np.fill_diagonal(repulsion, 0)
+        displacement = np.stack([ (dx * repulsion).sum(axis=1), (dy * repulsion).sum(axis=1) ], axis=1)
+
+        if len(edges):
+            edge_delta = positions[targets] - positions[sources]
+            edge_distance = np.maximum(np.sqrt((edge_delta**2).sum(axis=-1)), 1.0)
+            # Attraction grows with d^2/k, k being the edge's preferred length
+            force = edge_delta * (edge_distance / lengths)[:, None]
+            np.add.at(displacement, sources, force)
+            np.subtract.at(displacement, targets, force)
+
+        # Keep the unconnected parts of the graph from drifting apart
+        displacement -= positions * 0.01
+        displacement[anchored, 0] = 0
+
+        length = np.maximum(np.sqrt((displacement**2).sum(axis=-1)), 1e-9)
+        positions += displacement / length[:, None] * np.minimum(length, temperature)[:, None]
+        temperature = spread / 10 * (1 - (step + 1) / iterations) + 1
+
+    return { node: (float(x), float(y)) for node, (x, y) in zip(nodes, positions.round(1)) }
@@ -1,13 +1,21 @@
+import argparse
 import os
-import shutil
+import sys
 import webbrowser
-from collections import OrderedDict
+from typing import Callable, Iterable
 import networkx as nx
+import numpy as np
 from pyvis.network import Network
 
 
 from missions import Mission, Prerequisite, HyperlinkLike
-from scrapefandom import scrape_all_missions, scrape_all_missions_concurrent
+from graphcore import GraphCore
+from graphreduce import transitive_reduction
+from layout import force_layout
+from missionstore import MissionStore
+from timings import timings
+from tooltips import compact_tooltips, render_tooltip_script
+from viewer import write_viewer
 
 #def get_mission_color(mission: Mission):
 #    if mission.type.startswith('Basic'):
@@ -46,28 +54,103 @@ def get_mission_size(mission: Mission):
 #        return 0.10
 
 def simplify_edge_label(link: HyperlinkLike):
-    if link.title in link.text:
+    if link.title and link.title in link.text:
         return link.text.replace(link.title, '').strip()
     return link.text
 
-def build_graph(skip_basic=False):
-    graph = nx.DiGraph(arrows=True)
+def link_title(value: HyperlinkLike | str):
+    # Infobox values without a link are plain strings, which are their own title
+    return value if isinstance(value, str) else str(value.title)
 
-    # Draw nodes from missions
-    missions: OrderedDict[str, Mission] = OrderedDict()
-    for mission_title, mission in scrape_all_missions_concurrent():
+# Builder phases, in the order the edges used to be drawn in separate passes
+# over all missions. Attributes are merged in phase order, so the graph is
+# the same whatever order the missions arrive in.
+_mission_phase = 0
+_leadsto_phase = 1
+_prereq_phase = 2
+_required_phase = 3
+_reward_phase = 4
+
+_ignored_prereqs = ['/wiki/BLADE_Level', '/wiki/Level_(XCX)', '/wiki/Cross']
+
+class GraphBuilder:
+    # Adds each mission's nodes and edges as soon as it is scraped. Whether
+    # a prerequisite is a mission is only known once its page shows up, so
+    # such prerequisites wait in `pending` until then, or until finish().
+    def __init__(self, skip_basic=False):
+        self.skip_basic = skip_basic
+        self.graph = nx.DiGraph(arrows=True)
+        self.missions: dict[str, Mission] = {}
+        self.pending: dict[str, list[tuple[int, int, Mission, Prerequisite]]] = {}
+        self._node_layers: dict[str, dict[tuple, dict]] = {}
+        self._edge_layers: dict[tuple[str, str], dict[tuple, dict]] = {}
+        self._node_order: dict[str, tuple] = {}
+        self._chapter_edges: dict[int, list[tuple[tuple, tuple[str, str]]]] = {}
+        self._linked: set[int] = set()
+
+    def _add_node(self, key: tuple, node: str, **attr):
+        order = self._node_order.get(node)
+        if order is None or key < order:
+            self._node_order[node] = key
+        if not attr:
+            self.graph.add_node(node)
+            return
+        layers = self._node_layers.setdefault(node, {})
+        layers[key] = { **layers.get(key, {}), **attr }
+        merged = {}
+        for layer in sorted(layers):
+            merged.update(layers[layer])
+        self.graph.add_node(node)
+        self.graph.nodes[node].clear()
+        self.graph.nodes[node].update(merged)
+
+    def _add_edge(self, key: tuple, u: str, v: str, **attr):
+        self._add_node(key + (0,), u)
+        self._add_node(key + (1,), v)
+        layers = self._edge_layers.setdefault((u, v), {})
+        layers[key] = attr
+        merged = {}
+        for layer in sorted(layers):
+            merged.update(layers[layer])
+        self.graph.add_edge(u, v)
+        self.graph.edges[u, v].clear()
+        self.graph.edges[u, v].update(merged)
+
+    def add(self, mission_title: str, mission: Mission):
         if mission_title.startswith('File:'):
-            continue
-        if mission.type.startswith('Basic Mission') and skip_basic:
-            continue
-        missions[mission.href] = mission
-        graph.add_node(
-            mission.href,
+            return
+        if mission.type.startswith('Basic Mission') and self.skip_basic:
+            return
+        i = len(self.missions)
+        self.missions[mission.href] = mission
+        with timings.span('graph.nodes'):
+            self._add_mission_node(i, mission_title, mission)
+        with timings.span('graph.leadsto_edges'):
+            if mission.leadsto:
+                self._add_edge((_leadsto_phase, i, 0, 0), mission.href, mission.leadsto.href, label='leads to', dashes=True)
+        with timings.span('graph.prereq_edges'):
+            self._add_prereq_edges(i, mission)
+        with timings.span('graph.required_character_edges'):
+            for j, required in enumerate(mission.required):
+                key = (_required_phase, i, j)
+                self._add_edge(key + (0,), required.href, mission.href, required_character=required.href)
+                self._add_node(key + (1, 0), required.href, label=required.title, group='character', shape='square')
+        with timings.span('graph.reward_edges'):
+            for j, reward in enumerate(mission.rewards):
+                if reward.unlocks_recruits:
+                    for k, recruit in enumerate(reward.recruits):
+                        key = (_reward_phase, i, j, k)
+                        self._add_edge(key + (0,), mission.href, recruit.href, label=simplify_edge_label(reward))
+                        self._add_node(key + (1, 0), recruit.href, label=recruit.title, title=reward.embed, group='character', shape='square')
+
+    def _add_mission_node(self, i: int, mission_title: str, mission: Mission):
+        key = (_mission_phase, i, 0, 0)
+        self._add_node(key, mission.href,
             type=mission.type_enum,
-            location=str(mission.location.title),
-            client=str(mission.client.title),
+            location=link_title(mission.location),
+            client=link_title(mission.client),
             name=mission.name,
-            
+
             group=mission.type_enum,
             label=mission_title,
             size=get_mission_size(mission),
@@ -77,101 +160,151 @@ def build_graph(skip_basic=False):
         )
         if mission.type_enum == 'story':
             chapter = int(mission.name.replace('Chapter ', '')[:2])
-            graph.add_node(
-                mission.href,
+            self._add_node(key, mission.href,
                 x=(chapter - 6) * 500,
                 physics=False,
                 shape='box',
                 #level=chapter
             )
 
-    # Draw edges from leadsto data
-    for mission in missions.values():
-        if mission.leadsto:
-            graph.add_edge(mission.href, mission.leadsto.href, label='leads to', dashes=True)
-
-    # Draw edges from prerequisites
-    for mission in missions.values():
-        has_non_chapter_prereqs = False
-        for prereq in mission.prereqs:
-            if prereq.is_mission and prereq.href not in missions.keys():
-                continue
-            if not prereq.is_mission and prereq.href in missions.keys():
-                # Add edges from a mission to it's respective "Mission accepted" criteria
-                graph.add_edge(
-                    prereq.href,
-                    mission.href,
-                    label=simplify_edge_label(prereq),
-                    title=prereq.embed,
-                    dashes=True,
-                )
-            elif prereq.is_mission:
-                if 'Chapter' in prereq.title:
-                    # This is handled separately below
-                    continue
-                else:
-                    graph.add_edge(prereq.href, mission.href)
-            elif prereq.href is not None:
-                if prereq.href in ['/wiki/BLADE_Level', '/wiki/Level_(XCX)', '/wiki/Cross']:
-                    continue
-                graph.add_edge(
-                    prereq.href, mission.href,
-                    label=simplify_edge_label(prereq),
-                    title=prereq.embed,
-                    dashes=True,
-                )
-                graph.add_node(
-                    prereq.href,
-                    label=prereq.title,
-                    title=prereq.embed,
-                    group='other',
-                    shape='square',
-                    size=6,
-                )
-            else:
-                continue
-            has_non_chapter_prereqs = True
-        
-        # Set special attributes for chapter edges
-        for prereq in mission.prereqs:
+    def _add_prereq_edges(self, i: int, mission: Mission):
+        prereqs = mission.prereqs
+        for j, prereq in enumerate(prereqs):
             if prereq.is_mission and 'Chapter' in prereq.title:
-                chapter = int(prereq.title.replace('Chapter ', '')[:2])
-                graph.add_edge(prereq.href, mission.href,
-                               length=95 if mission.type_enum == 'basic' or has_non_chapter_prereqs else 190,
-                )#physics=False if has_non_chapter_prereqs and mission.type_enum != 'basic' else True)
-
-    # Draw edges from required characters
-    for mission in missions.values():
-        for required in mission.required:
-            graph.add_edge(required.href, mission.href, required_character=required.href)
-            graph.add_node(required.href, label=required.title, group='character', shape='square')
-
-    # Draw edges from rewards
-    for mission in missions.values():
-        for reward in mission.rewards:
-            if reward.unlocks_recruits:
-                for recruit in reward.recruits:
-                    graph.add_edge(mission.href, recruit.href, label=simplify_edge_label(required))
-                    graph.add_node(recruit.href, label=recruit.title, title=reward.embed, group='character', shape='square')
-
-    return graph
-
-def build_graph_network():
-    graph = build_graph()
+                # Chapters get an edge whether or not they were scraped,
+                # its length depends on the mission's other prerequisites
+                key = (_prereq_phase, i, len(prereqs) + j, 0)
+                self._chapter_edges.setdefault(i, []).append((key, (prereq.href, mission.href)))
+                self._add_edge(key, prereq.href, mission.href, length=self._chapter_length(i, mission))
+            elif prereq.href is None or prereq.href in self.missions:
+                self._resolve(i, j, mission, prereq)
+            else:
+                self.pending.setdefault(prereq.href, []).append((i, j, mission, prereq))
+        for i_, j, waiting, prereq in self.pending.pop(mission.href, []):
+            self._resolve(i_, j, waiting, prereq)
+
+    def _chapter_length(self, i: int, mission: Mission):
+        return 95 if mission.type_enum == 'basic' or i in self._linked else 190
+
+    def _resolve(self, i: int, j: int, mission: Mission, prereq: Prerequisite):
+        key = (_prereq_phase, i, j)
+        is_mission = prereq.href in self.missions
+        if prereq.is_mission and not is_mission:
+            return
+        if not prereq.is_mission and is_mission:
+            # Add edges from a mission to it's respective "Mission accepted" criteria
+            self._add_edge(key + (0,), prereq.href, mission.href,
+                label=simplify_edge_label(prereq),
+                title=prereq.embed,
+                dashes=True,
+            )
+        elif prereq.is_mission:
+            self._add_edge(key + (0,), prereq.href, mission.href)
+        elif prereq.href is not None:
+            if prereq.href in _ignored_prereqs:
+                return
+            self._add_edge(key + (0,), prereq.href, mission.href,
+                label=simplify_edge_label(prereq),
+                title=prereq.embed,
+                dashes=True,
+            )
+            self._add_node(key + (1, 0), prereq.href,
+                label=prereq.title,
+                title=prereq.embed,
+                group='other',
+                shape='square',
+                size=6,
+            )
+        else:
+            return
+        if i not in self._linked:
+            self._linked.add(i)
+            for chapter_key, (u, v) in self._chapter_edges.get(i, []):
+                self._add_edge(chapter_key, u, v, length=self._chapter_length(i, mission))
+
+    def progress(self):
+        return {
+            'missions': len(self.missions),
+            'nodes': self.graph.number_of_nodes(),
+            'edges': self.graph.number_of_edges(),
+            'pending': sum(len(waiting) for waiting in self.pending.values()),
+            'pending_targets': len(self.pending),
+        }
+
+    def finish(self) -> nx.DiGraph:
+        # Whatever is still pending was never scraped, so it isn't a mission
+        with timings.span('graph.prereq_edges'):
+            for href in [*self.pending]:
+                for i, j, mission, prereq in self.pending.pop(href):
+                    self._resolve(i, j, mission, prereq)
+        # Same node and edge order as drawing the phases one after another
+        with timings.span('graph.finish'):
+            graph = nx.DiGraph(arrows=True)
+            for node in sorted(self._node_order, key=self._node_order.get):
+                graph.add_node(node, **self.graph.nodes[node])
+            for u, v in sorted(self._edge_layers, key=lambda edge: min(self._edge_layers[edge])):
+                graph.add_edge(u, v, **self.graph.edges[u, v])
+        return graph
+
+def build_graph(skip_basic=False, source: Iterable[tuple[str, Mission]] = None, progress: Callable[[GraphBuilder], None] = None):
+    if source is None:
+        # Imported here so graphs can be built from a MissionStore without bs4
+        from scrapefandom import scrape_all_missions_concurrent
+        source = scrape_all_missions_concurrent()
+    builder = GraphBuilder(skip_basic)
+    # The graph phases are timed inside GraphBuilder, graph.source is the
+    # time spent waiting for the next mission, i.e. scraping
+    missions = iter(source)
+    while True:
+        with timings.span('graph.source'):
+            item = next(missions, None)
+        if item is None:
+            break
+        builder.add(*item)
+        if progress is not None:
+            progress(builder)
+    return builder.finish()
 
+def print_progress(builder: GraphBuilder):
+    progress = builder.progress()
+    print(f"\r{progress['missions']} missions, {progress['nodes']} nodes, {progress['edges']} edges, "
+          f"{progress['pending']} prerequisites waiting on {progress['pending_targets']} pages", end='', file=sys.stderr)
+
+def build_graph_network(source: Iterable[tuple[str, Mission]] = None, static_layout=False):
+    return make_graph_network(build_graph(source=source), static_layout)
+
+def make_graph_network(graph: nx.DiGraph | GraphCore, static_layout=False):
+    # Reduction, sizing and export run on the array form of the graph
+    core = graph if isinstance(graph, GraphCore) else GraphCore.from_nx(graph)
+    with timings.span('network.reduction'):
+        core = reduce_core(core)
+    with timings.span('network.degree_sizing'):
+        size_core_by_degree(core)
+    if static_layout:
+        with timings.span('network.layout'):
+            positions = force_layout(core.to_nx())
+            core.node_attributes.set('x', [ positions[node][0] for node in core.nodes ])
+            core.node_attributes.set('y', [ positions[node][1] for node in core.nodes ])
+    with timings.span('network.pyvis_export'):
+        return make_network(core, static_layout=static_layout)
+
+def _keep_reduced_edge(node_key0: str, node_key1: str, data: dict):
+    # Labeled edges and edges that aren't from chapters or required characters are kept.
+    return 'label' in data or ('Chapter' not in node_key0 and 'required_character' not in data)
+
+def reduce_graph(graph: nx.DiGraph):
     # Perform transitive reduction on the graph.
     # e.g. missions that depend on both BFFs and Chapter 5 will only
     # depend on BFFs because BFFs already depends on Chapter 5.
-    reduced_graph: nx.DiGraph = nx.transitive_reduction(graph)
-    for key, data in graph.nodes.data():
-        reduced_graph.add_node(key, **data)
-    for node_key0, node_key1, data in graph.edges.data():
-        if (node_key0, node_key1) in reduced_graph.edges or 'label' in data:
-            reduced_graph.add_edge(node_key0, node_key1, **data)
-        elif 'Chapter' not in node_key0 and 'required_character' not in data:
-            reduced_graph.add_edge(node_key0, node_key1, **data)
-    graph = reduced_graph
+    return transitive_reduction(graph, keep=_keep_reduced_edge)
+
+def reduce_core(core: GraphCore):
+    # reduce_graph, with _keep_reduced_edge as a mask over all edges at once
+    from_chapter = np.array([ 'Chapter' in node for node in core.nodes ], dtype=bool)[core.sources()]
+    edges = core.edge_attributes
+    return core.transitive_reduction(keep=edges.has('label') | (~from_chapter & ~edges.has('required_character')))
 
+def size_nodes_by_degree(graph: nx.DiGraph):
     # Set node value based on degree
     degrees = nx.centrality.out_degree_centrality(graph)
     node_count = len(graph.nodes)
@@ -180,6 +313,18 @@ def build_graph_network():
         graph.add_node(key, size=size+degrees[key]*(node_count-1))
         #graph.add_node(key, value=min(degree, 1))
 
+def size_core_by_degree(core: GraphCore):
+    # size_nodes_by_degree, same arithmetic so the sizes come out identical
+    node_count = len(core)
+    if node_count <= 1:
+        degrees = np.ones(node_count)
+    else:
+        degrees = core.out_degree() * (1.0 / (node_count - 1.0))
+    has_size = core.node_attributes.has('size')
+    sizes = [ core.node_attributes.value('size', i) if has_size[i] else 10 for i in range(node_count) ]
+    core.node_attributes.set('size', [ size + degree * (node_count - 1) for size, degree in zip(sizes, degrees.tolist()) ])
+
+def make_network(graph: nx.DiGraph | GraphCore, static_layout=False):
     net = Network(
         height='100%',
         width='100%',
@@ -191,7 +336,10 @@ def build_graph_network():
         bgcolor='#000000',
         font_color='#FFFFFF',
     )
-    net.from_nx(graph)
+    if isinstance(graph, GraphCore):
+        graph.to_network(net)
+    else:
+        net.from_nx(graph)
     net.options.interaction.__dict__['hover'] = True
     net.options.layout.hierarchical.enabled = False
     net.options.layout.randomSeed = 2015_04_25
@@ -201,6 +349,9 @@ def build_graph_network():
 
     net.options.physics.stabilization.iterations = 500
     net.options.physics.stabilization.updateInterval = 10
+    if static_layout:
+        # Every node already has its x/y from layout.force_layout
+        net.options.physics.enabled = False
     #net.options.physics.stabilization.onlyDynamicEdges = True
     #net.options.physics.stabilization.fit = False
 
@@ -318,9 +469,7 @@ def build_graph_network():
     }
     return net
 
-def show_net(net: Network, file='index.html', notebook=False):
-    html = net.generate_html(file, local=False, notebook=notebook)
-    extra_header = '''
+html_header = '''
 
         <!-- HTML Meta Tags -->
         <title>Xenoblade Chronicles X - Interactive Mission Graph</title>
@@ -443,10 +592,25 @@ def show_net(net: Network, file='index.html', notebook=False):
         </style>
         
     '''
+
+def show_net(net: Network, file='index.html', notebook=False, open_browser=True, compact=False):
+    with timings.span('html.render'):
+        html = render_html(net, file, notebook=notebook, compact=compact)
+    with timings.span('html.write'):
+        with open(file, 'w+', encoding='utf8') as out:
+            out.write(html)
+    if open_browser:
+        webbrowser.open(file)
+
+def render_html(net: Network, file='index.html', notebook=False, compact=False):
+    if compact:
+        # Moves the tooltips out of the network into a compressed table
+        tooltip_table = compact_tooltips(net)
+    html = net.generate_html(file, local=False, notebook=notebook)
     # Insert additional header tags
     header_tag = '<meta charset="utf-8">'
     head_pos = html.index(header_tag)
-    html = html[:head_pos+len(header_tag)] + extra_header + html[head_pos+len(header_tag):]
+    html = html[:head_pos+len(header_tag)] + html_header + html[head_pos+len(header_tag):]
 
     # Update to latest version of vis-network
     html = html.replace('vis-network/9.1.2', 'vis-network/9.1.9')
@@ -454,13 +618,154 @@ def show_net(net: Network, file='index.html', notebook=False):
     html = html.replace('sha512-LnvoEWDFrqGHlHmDD2101OrLcbsfkrzoSpvtSQtxK3RMnRV0eOkhhBN2dXHKRrUU8p2DGRTk35n4O8nWSVe1mQ==',
                         'sha512-4/EGWWWj7LIr/e+CvsslZkRk0fHDpf04dydJHoHOH32Mpw8jYU28GNI6mruO7fh/1kq15kSvwhKJftMSlgm0FA==')
 
+    if compact:
+        body_end = html.rindex('</body>')
+        html = html[:body_end] + render_tooltip_script(tooltip_table) + html[body_end:]
+
     html = '<!DOCTYPE html>\n' + html
+    return html
 
-    with open(file, 'w+', encoding='utf8') as out:
-        out.write(html)
-    webbrowser.open(file)
+def _positive_int(text: str):
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{text}' is not a whole number")
+    if value < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, not {value}')
+    return value
 
 
 if __name__ == '__main__':
-    network = build_graph_network()
-    show_net(network)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--incremental', action='store_true',
+                        help='only re-scrape mission pages whose wiki revision changed since the last run')
+    parser.add_argument('--api', action='store_true',
+                        help='fetch missions through batched wiki API requests, falling back to the articles where needed')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='scrape with the asyncio engine, which fetches mission pages while the categories are still being crawled')
+    parser.add_argument('--offline', action='store_true',
+                        help='build the graph only from the mission store, without scraping')
+    parser.add_argument('--store', default='.mission_store.sqlite',
+                        help='mission store that parsed missions are read from and saved to')
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help='replay wiki pages from a snapshot made with snapshot.py instead of the network')
+    parser.add_argument('--checkpoint', default='.scrape_checkpoint.jsonl', metavar='PATH',
+                        help='record finished pages here so an interrupted scrape resumes where it stopped')
+    parser.add_argument('--no-checkpoint', action='store_true',
+                        help='scrape every page again even if an earlier run was interrupted')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='times to retry a page after a timeout, connection error or 5xx')
+    parser.add_argument('--max-in-flight', type=_positive_int, metavar='CHUNKS',
+                        help='chunks of pages being scraped or waiting to be added to the graph at once, twice the workers by default')
+    parser.add_argument('--ordered', action='store_true',
+                        help='add missions in category order instead of as soon as they are scraped')
+    parser.add_argument('--failure-report', metavar='PATH',
+                        help='write the pages that could not be scraped to PATH as JSON')
+    parser.add_argument('--category-ttl', type=float, metavar='HOURS',
+                        help='hours before cached category pages are revalidated with the wiki')
+    parser.add_argument('--page-ttl', type=float, metavar='HOURS',
+                        help='hours before cached mission pages are revalidated with the wiki')
+    parser.add_argument('--cache-max-mb', type=float, metavar='MB',
+                        help='evict the least recently used responses once the HTTP cache is larger than this')
+    parser.add_argument('--compact', action='store_true',
+                        help='store tooltips once in a compressed table instead of inline on every node and edge')
+    parser.add_argument('--static-layout', action='store_true',
+                        help='compute node positions here so browsers can skip the physics simulation')
+    parser.add_argument('--viewer', metavar='DIR',
+                        help='write a static viewer page and a separate, versioned graph payload to DIR')
+    parser.add_argument('--partition', choices=['chapter', 'location'],
+                        help='write one viewer page per chapter or location plus an overview page, needs --viewer')
+    parser.add_argument('--progress', action='store_true',
+                        help='show the missions, nodes and edges added so far and the prerequisites still waiting for their page')
+    parser.add_argument('--timings', action='store_true',
+                        help='print how long each phase took and the HTTP cache hits and misses')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='run under cProfile and save the stats to PATH, e.g. for snakeviz')
+    args = parser.parse_args()
+    if args.partition and not args.viewer:
+        parser.error('--partition needs --viewer DIR')
+    if args.use_async and args.snapshot:
+        parser.error("--async doesn't replay snapshots, serve one with snapshot.py serve instead")
+
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if args.snapshot:
+        from scrapefandom import use_snapshot
+        use_snapshot(args.snapshot)
+    elif args.category_ttl is not None or args.page_ttl is not None or args.cache_max_mb is not None:
+        from dataclasses import replace
+        from httpcache import CachePolicy
+        from scrapefandom import use_cache_policy
+        policy = CachePolicy()
+        if args.category_ttl is not None:
+            policy = replace(policy, category_ttl=args.category_ttl * 60 * 60)
+        if args.page_ttl is not None:
+            policy = replace(policy, page_ttl=args.page_ttl * 60 * 60)
+        if args.cache_max_mb is not None:
+            policy = replace(policy, max_size_mb=args.cache_max_mb)
+        use_cache_policy(policy)
+
+    progress = print_progress if args.progress else None
+    checkpoint = None
+    if not args.offline and not args.use_async and not args.no_checkpoint:
+        from checkpoint import ScrapeCheckpoint
+        checkpoint = ScrapeCheckpoint(args.checkpoint)
+        if len(checkpoint):
+            print(f"Resuming from '{args.checkpoint}', {len(checkpoint)} pages are already done", file=sys.stderr)
+    failures = []
+    with MissionStore(args.store) as store:
+        scrape_options = dict(store=store, checkpoint=checkpoint, retries=args.retries, failures=failures)
+        if args.offline:
+            graph = build_graph(source=store.missions(), progress=progress)
+        elif args.use_async:
+            from asyncfandom import iter_all_missions
+            graph = build_graph(source=iter_all_missions(failures=failures), progress=progress)
+        elif args.api:
+            from scrapefandom import scrape_all_missions_api
+            graph = build_graph(source=scrape_all_missions_api(**scrape_options), progress=progress)
+        elif args.incremental:
+            from scrapefandom import scrape_all_missions_incremental
+            graph = build_graph(source=scrape_all_missions_incremental(**scrape_options), progress=progress)
+        else:
+            from scrapefandom import scrape_all_missions_concurrent
+            graph = build_graph(source=scrape_all_missions_concurrent(**scrape_options, max_in_flight=args.max_in_flight,
+                                                                      ordered=args.ordered), progress=progress)
+    if args.progress:
+        print(file=sys.stderr)
+    if failures:
+        stale = sum(failure.stale for failure in failures)
+        print(f'{len(failures)} pages could not be scraped, {stale} of them are in the graph as stored before and'
+              f' {len(failures) - stale} are missing, run again to retry them', file=sys.stderr)
+    if args.failure_report:
+        from scrapefandom import write_failure_report
+        write_failure_report(failures, args.failure_report)
+    if checkpoint is not None:
+        # The run finished, so nothing is left to resume. Kept, it would serve
+        # its pages to every later run even after they are edited on the wiki.
+        checkpoint.remove()
+    if not args.offline:
+        from scrapefandom import maintain_http_cache
+        with timings.span('http_cache.maintain'):
+            maintain_http_cache()
+    if args.partition:
+        from partitions import write_partitions
+        write_partitions(graph, args.viewer, args.partition, compact=args.compact, static_layout=args.static_layout)
+    elif args.viewer:
+        network = make_graph_network(graph, args.static_layout)
+        with timings.span('html.render'):
+            html = render_html(network, compact=args.compact)
+        with timings.span('html.write'):
+            write_viewer(html, args.viewer)
+    else:
+        show_net(make_graph_network(graph, args.static_layout), compact=args.compact)
+
+    if args.profile:
+        import pstats
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(20)
+    if args.timings or args.profile:
+        timings.print_summary()
@@ -0,0 +1,176 @@
+import copy
+import urllib.parse
+import lxml.etree
+import lxml.html
+import requests
+import requests_cache
+from bs4 import BeautifulSoup, SoupStrainer, Tag, UnicodeDammit
+from bs4.builder._lxml import LXMLTreeBuilder
+
+from missions import EntryRecord, LinkRecord, MissionRecord
+from timings import count_cache_response
+
+_base_url = 'https://xenoblade.fandom.com/'
+_builder = LXMLTreeBuilder()
+_infobox_xpath = lxml.etree.XPath(
+    "(//div[contains(concat(' ', normalize-space(@class), ' '), ' xcx ')"
+    " and contains(concat(' ', normalize-space(@class), ' '), ' mission ')])[1]"
+)
+_batch_infobox_xpath = lxml.etree.XPath(
+    "(.//div[contains(concat(' ', normalize-space(@class), ' '), ' xcx ')"
+    " and contains(concat(' ', normalize-space(@class), ' '), ' mission ')])[1]"
+)
+
+def _extract_link(a: Tag):
+    href = a.get('href')
+    title = a.get('title')
+    string = a.string
+    return LinkRecord(
+        href=str(href) if href is not None else None,
+        title=str(title) if title is not None else None,
+        text=a.get_text(),
+        string=str(string) if string is not None else None,
+    )
+
+def _get_data_value_div(info_box: Tag, data_source: str):
+    tag = info_box.find('div', {'data-source': data_source}, class_='pi-data')
+    if tag is None:
+        return None
+    pi_data_value = tag.find('div', class_='pi-data-value')
+    return pi_data_value
+
+def _get_data_value(info_box: Tag, data_source: str):
+    pi_data_value = _get_data_value_div(info_box, data_source)
+    if pi_data_value is None:
+        return None
+    a = pi_data_value.find('a')
+    return _extract_link(a) if a is not None else str(pi_data_value.get_text().strip())
+
+def _entry_from_run(div: Tag, run: list):
+    # Every <br> separated line of the value becomes one entry, taken
+    # straight from the infobox instead of from a copy of the line
+    links = []
+    for child in run:
+        if isinstance(child, Tag):
+            if child.name == 'a':
+                links.append(child)
+            links += child.find_all('a')
+    for a in links:
+        a['target'] = '_blank'
+    shell = div.copy_self().decode()
+    closing = shell.rindex('</')
+    return EntryRecord(
+        text=''.join(child.get_text() for child in run),
+        links=tuple(_extract_link(a) for a in links),
+        embed=shell[:closing] + ''.join(child.decode() if isinstance(child, Tag) else child.output_ready()
+                                        for child in run) + shell[closing:],
+    )
+
+def _get_data_value_list(info_box: Tag, data_source: str):
+    div = _get_data_value_div(info_box, data_source)
+    if div is None:
+        return
+    run = []
+    for child in div.contents:
+        if isinstance(child, Tag) and child.name == 'br':
+            if run:
+                yield _entry_from_run(div, run)
+            run = []
+            continue
+        run.append(child)
+    if run:
+        yield _entry_from_run(div, run)
+
+def _render_embed(info_box: Tag, href: str):
+    embed = copy.deepcopy(info_box)
+    h2 = embed.find('h2', {'data-source': 'name'})
+    new_a = Tag(name='a', attrs={'href': href}, builder=_builder)
+    for content in reversed(h2.contents):
+        new_a.insert(0, content.extract())
+    h2.insert(0, new_a)
+    for a in embed.find_all('a'):
+        a['target'] = '_blank'
+    aside = embed.find('aside', class_='portable-infobox')
+    if aside:
+        aside['style'] = 'margin: 0px'
+    return embed.decode()
+
+def extract_mission_record(url: str | bytes, info_box: Tag) -> MissionRecord:
+    href = urllib.parse.urlparse(url).path
+    nav = info_box.find('nav')
+    difficulty = _get_data_value(info_box, 'difficulty')
+    if isinstance(difficulty, str) and difficulty:
+        difficulty = difficulty.strip('-').strip()
+    required = _get_data_value_div(info_box, 'required')
+    return MissionRecord(
+        href=href,
+        name=info_box.find('h2', {'data-source': 'name'}).get_text(),
+        type=nav.get_text().strip() if nav else None,
+        summary=_get_data_value(info_box, 'summary'),
+        client=_get_data_value(info_box, 'client'),
+        location=_get_data_value(info_box, 'location'),
+        difficulty=difficulty,
+        leadsto=_get_data_value(info_box, 'leadsto'),
+        required=tuple(_extract_link(a) for a in required.find_all('a')) if required is not None else (),
+        prereqs=tuple(_get_data_value_list(info_box, 'prereqs')),
+        rewards=tuple(_get_data_value_list(info_box, 'rewards')),
+        embed=_render_embed(info_box, href),
+    )
+
+def find_infobox(content: str | bytes, *, full_parse=False):
+    if full_parse:
+        mission_strainer = SoupStrainer('div', class_='xcx mission')
+        soup = BeautifulSoup(content, builder=_builder)
+        return soup.find(mission_strainer)
+
+    # Locate the infobox with lxml alone and only build bs4 objects for its
+    # subtree, instead of turning the whole wiki page into a bs4 tree.
+    if isinstance(content, bytes):
+        # Decode the way bs4 would, lxml alone assumes latin-1 without a <meta charset>
+        content = UnicodeDammit(content, is_html=True).unicode_markup
+    if not content or not content.strip():
+        return None
+    document = lxml.html.document_fromstring(content)
+    elements = _infobox_xpath(document)
+    if not elements:
+        return None
+    info_box_html = lxml.html.tostring(elements[0], encoding='unicode', with_tail=False)
+    return BeautifulSoup(info_box_html, builder=_builder).find('div')
+
+def find_batch_infoboxes(content: str) -> dict[str, Tag]:
+    # Infoboxes rendered by wikiapi.render_templates, by page title
+    if not content or not content.strip():
+        return {}
+    infoboxes = {}
+    for element in lxml.html.fragment_fromstring(content, create_parent='div').iterfind('.//div[@data-batch-title]'):
+        info_box = _batch_infobox_xpath(element)
+        if not info_box:
+            continue
+        info_box_html = lxml.html.tostring(info_box[0], encoding='unicode', with_tail=False)
+        infoboxes[element.get('data-batch-title')] = BeautifulSoup(info_box_html, builder=_builder).find('div')
+    return infoboxes
+
+def parse_mission_record(url: str | bytes, content: str | bytes) -> MissionRecord | None:
+    info_box = find_infobox(content)
+    if info_box is None:
+        return None
+    return extract_mission_record(url, info_box)
+
+def request_page(url: str | bytes, *, timeout=-1, session: requests.Session = None, refresh=False) -> bytes:
+    if '://' not in url:
+        url = urllib.parse.urljoin(_base_url, url)
+    if session is None:
+        response = requests.get(url, timeout=timeout)
+    elif refresh and isinstance(session, requests_cache.CachedSession):
+        response = session.get(url, timeout=timeout, force_refresh=True)
+    else:
+        response = session.get(url, timeout=timeout)
+    count_cache_response(response)
+    response.raise_for_status()
+    return response.content
+
+def request_infobox(url: str | bytes, *, timeout=-1, session: requests.Session = None, refresh=False):
+    return find_infobox(request_page(url, timeout=timeout, session=session, refresh=refresh))
+
+def request_mission_record(url: str | bytes, *, timeout=-1, session: requests.Session = None, refresh=False) -> MissionRecord | None:
+    return parse_mission_record(url, request_page(url, timeout=timeout, session=session, refresh=refresh))
@@ -0,0 +1,234 @@
+import argparse
+import json
+import sys
+from collections import deque
+import networkx as nx
+
+from graphreduce import condense
+
+snapshot_version = 1
+default_snapshot_path = 'mission_graph.json'
+
+def _bits(bitset: int):
+    while bitset:
+        low = bitset & -bitset
+        yield low.bit_length() - 1
+        bitset ^= low
+
+class MissionGraph:
+    # Answers "what comes before/after this mission" from a reachability
+    # index instead of the DiGraph: every strongly connected component has
+    # the set of nodes before and after it as an int bitset, so membership
+    # tests are a single bit test and listing a set is linear in its size.
+    def __init__(self, nodes: list[str], attributes: list[dict], successors: list[list[int]],
+                 component: list[int], ancestors: list[int], descendants: list[int]):
+        self.nodes = nodes
+        self.attributes = attributes
+        self.successors = successors
+        self.predecessors: list[list[int]] = [ [] for _ in nodes ]
+        for u, targets in enumerate(successors):
+            for v in targets:
+                self.predecessors[v].append(u)
+        self.component = component
+        self.ancestors = ancestors
+        self.descendants = descendants
+        self.index = { node: i for i, node in enumerate(nodes) }
+        self._labels = { str(data.get('label', '')).casefold(): node for node, data in zip(nodes, attributes) if data.get('label') }
+        # Names without the label's disambiguation, e.g. "Chapter 5" for
+        # "Chapter 5 (XCX)", as long as only one mission has that name
+        names: dict[str, list[str]] = {}
+        for node, data in zip(nodes, attributes):
+            if data.get('name'):
+                names.setdefault(str(data['name']).casefold(), []).append(node)
+        self._names = { name: named[0] for name, named in names.items() if len(named) == 1 }
+        # Components are numbered in reverse topological order
+        component_count = max(component, default=-1) + 1
+        self._rank = [ component_count - 1 - c for c in component ]
+
+    @classmethod
+    def from_graph(cls, graph: nx.DiGraph):
+        nodes = [*graph]
+        index = { node: i for i, node in enumerate(nodes) }
+        successors = [ [ index[v] for v in graph.successors(node) ] for node in nodes ]
+        component, components = condense(successors)
+
+        members = [0] * components
+        for node, c in enumerate(component):
+            members[c] |= 1 << node
+        component_successors: list[set[int]] = [ set() for _ in range(components) ]
+        component_predecessors: list[set[int]] = [ set() for _ in range(components) ]
+        for u, targets in enumerate(successors):
+            for v in targets:
+                if component[u] != component[v]:
+                    component_successors[component[u]].add(component[v])
+                    component_predecessors[component[v]].add(component[u])
+
+        # Members of a cycle are each other's ancestors and descendants
+        cyclic = [ members[c] if members[c] & (members[c] - 1) else 0 for c in range(components) ]
+        descendants = [0] * components
+        for c in range(components):
+            for s in component_successors[c]:
+                descendants[c] |= members[s] | descendants[s]
+        ancestors = [0] * components
+        for c in reversed(range(components)):
+            for p in component_predecessors[c]:
+                ancestors[c] |= members[p] | ancestors[p]
+        for c in range(components):
+            descendants[c] |= cyclic[c]
+            ancestors[c] |= cyclic[c]
+
+        attributes = [ { key: graph.nodes[node][key] for key in ('label', 'name', 'group') if key in graph.nodes[node] }
+                       for node in nodes ]
+        return cls(nodes, attributes, successors, component, ancestors, descendants)
+
+    @classmethod
+    def from_store(cls, store):
+        from missiongraph import build_graph
+        return cls.from_graph(build_graph(source=store.missions()))
+
+    def to_json(self):
+        return {
+            'version': snapshot_version,
+            'nodes': self.nodes,
+            'attributes': self.attributes,
+            'successors': self.successors,
+            'component': self.component,
+            'ancestors': [ format(bitset, 'x') for bitset in self.ancestors ],
+            'descendants': [ format(bitset, 'x') for bitset in self.descendants ],
+        }
+
+    @classmethod
+    def from_json(cls, data: dict):
+        if data.get('version') != snapshot_version:
+            raise ValueError(f"unsupported mission graph snapshot version {data.get('version')!r}")
+        return cls(data['nodes'], data['attributes'], data['successors'], data['component'],
+                   [ int(bitset, 16) for bitset in data['ancestors'] ],
+                   [ int(bitset, 16) for bitset in data['descendants'] ])
+
+    def save(self, path=default_snapshot_path):
+        with open(path, 'w', encoding='utf8') as f:
+            json.dump(self.to_json(), f, separators=(',', ':'), ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path=default_snapshot_path):
+        with open(path, encoding='utf8') as f:
+            return cls.from_json(json.load(f))
+
+    def resolve(self, name: str) -> str:
+        # Accepts a node href, a mission title or its name, case insensitively
+        if name in self.index:
+            return name
+        if not name.startswith('/wiki/') and '/wiki/' + name.replace(' ', '_') in self.index:
+            return '/wiki/' + name.replace(' ', '_')
+        node = self._labels.get(name.casefold(), self._names.get(name.casefold()))
+        if node is None:
+            raise KeyError(name)
+        return node
+
+    def _ordered(self, bitset: int):
+        # Topological order, so prerequisites are listed in an order they can be done in
+        return [ self.nodes[i] for i in sorted(_bits(bitset), key=lambda i: (self._rank[i], self.nodes[i])) ]
+
+    def prerequisites(self, mission: str) -> list[str]:
+        return self._ordered(self.ancestors[self.component[self.index[self.resolve(mission)]]])
+
+    def unlocks(self, mission: str) -> list[str]:
+        return self._ordered(self.descendants[self.component[self.index[self.resolve(mission)]]])
+
+    def direct_prerequisites(self, mission: str) -> list[str]:
+        return [ self.nodes[i] for i in self.predecessors[self.index[self.resolve(mission)]] ]
+
+    def direct_unlocks(self, mission: str) -> list[str]:
+        return [ self.nodes[i] for i in self.successors[self.index[self.resolve(mission)]] ]
+
+    def is_prerequisite(self, before: str, after: str) -> bool:
+        before, after = self.index[self.resolve(before)], self.index[self.resolve(after)]
+        return bool(self.ancestors[self.component[after]] >> before & 1)
+
+    def shortest_path(self, source: str, target: str) -> list[str] | None:
+        # Breadth first search that never leaves the ancestors of the target
+        source, target = self.index[self.resolve(source)], self.index[self.resolve(target)]
+        if source == target:
+            return [ self.nodes[source] ]
+        allowed = self.ancestors[self.component[target]] | 1 << target
+        if not allowed >> source & 1:
+            return None
+        previous = { source: source }
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            for successor in self.successors[node]:
+                if successor in previous or not allowed >> successor & 1:
+                    continue
+                previous[successor] = node
+                if successor == target:
+                    path = [target]
+                    while path[-1] != source:
+                        path.append(previous[path[-1]])
+                    return [ self.nodes[i] for i in reversed(path) ]
+                queue.append(successor)
+        return None
+
+    def label(self, node: str) -> str:
+        return self.attributes[self.index[node]].get('label', node)
+
+    def __contains__(self, mission: str):
+        try:
+            self.resolve(mission)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return len(self.nodes)
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Prerequisite and unlock queries over the mission graph')
+    parser.add_argument('--snapshot', default=default_snapshot_path, help='mission graph snapshot to query')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help='build the snapshot from the mission store')
+    build.add_argument('--store', default='.mission_store.sqlite')
+
+    for name, help in [('prereqs', 'everything that comes before a mission'),
+                       ('unlocks', 'everything that comes after a mission'),
+                       ('direct-prereqs', 'the direct prerequisites of a mission'),
+                       ('direct-unlocks', 'what a mission directly unlocks')]:
+        command = commands.add_parser(name, help=help)
+        command.add_argument('mission', help='mission title or wiki href')
+
+    path = commands.add_parser('path', help='shortest chain of prerequisites from one mission to another')
+    path.add_argument('source')
+    path.add_argument('target')
+
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        from missionstore import MissionStore
+        with MissionStore(args.store, readonly=True) as store:
+            mission_graph = MissionGraph.from_store(store)
+        mission_graph.save(args.snapshot)
+        print(f"Saved {len(mission_graph)} nodes to '{args.snapshot}'", file=sys.stderr)
+        return
+
+    mission_graph = MissionGraph.load(args.snapshot)
+    for name in [ getattr(args, key) for key in ('mission', 'source', 'target') if hasattr(args, key) ]:
+        if name not in mission_graph:
+            parser.error(f"unknown mission '{name}'")
+    if args.command == 'path':
+        result = mission_graph.shortest_path(args.source, args.target)
+        if result is None:
+            print(f'{args.target} does not depend on {args.source}', file=sys.stderr)
+            sys.exit(1)
+    else:
+        query = {
+            'prereqs': mission_graph.prerequisites,
+            'unlocks': mission_graph.unlocks,
+            'direct-prereqs': mission_graph.direct_prerequisites,
+            'direct-unlocks': mission_graph.direct_unlocks,
+        }[args.command]
+        result = query(args.mission)
+    for node in result:
+        print(f'{mission_graph.label(node)}\t{node}')
+
+if __name__ == '__main__':
+    main()
@@ -1,86 +1,118 @@
-import copy
-import urllib.parse
+import json
+from dataclasses import asdict, dataclass
 import requests
-import requests_cache
-from bs4 import BeautifulSoup, PageElement, SoupStrainer, Tag
-from bs4.builder._lxml import LXMLTreeBuilder
 
-
-_base_url = 'https://xenoblade.fandom.com/'
-_builder = LXMLTreeBuilder()
+# Bump whenever the fields of the records below or the way missionparser
+# fills them changes, stored records from older versions are discarded.
+record_schema_version = 1
+
+@dataclass(frozen=True, slots=True)
+class LinkRecord:
+    href: str | None
+    title: str | None
+    text: str
+    string: str | None
+
+@dataclass(frozen=True, slots=True)
+class EntryRecord:
+    text: str
+    links: tuple[LinkRecord, ...]
+    embed: str
+
+@dataclass(frozen=True, slots=True)
+class MissionRecord:
+    href: str
+    name: str
+    type: str | None
+    summary: LinkRecord | str | None
+    client: LinkRecord | str | None
+    location: LinkRecord | str | None
+    difficulty: LinkRecord | str | None
+    leadsto: LinkRecord | str | None
+    required: tuple[LinkRecord, ...]
+    prereqs: tuple[EntryRecord, ...]
+    rewards: tuple[EntryRecord, ...]
+    embed: str
+
+def record_to_json(record: MissionRecord) -> str:
+    return json.dumps(asdict(record), ensure_ascii=False, separators=(',', ':'))
+
+def _link_from_json(value):
+    return LinkRecord(**value) if isinstance(value, dict) else value
+
+def _entry_from_json(value: dict):
+    return EntryRecord(
+        text=value['text'],
+        links=tuple(LinkRecord(**link) for link in value['links']),
+        embed=value['embed'],
+    )
+
+def record_from_json(text: str | bytes) -> MissionRecord:
+    return record_from_dict(json.loads(text))
+
+def record_from_dict(value: dict) -> MissionRecord:
+    return MissionRecord(
+        href=value['href'],
+        name=value['name'],
+        type=value['type'],
+        summary=_link_from_json(value['summary']),
+        client=_link_from_json(value['client']),
+        location=_link_from_json(value['location']),
+        difficulty=_link_from_json(value['difficulty']),
+        leadsto=_link_from_json(value['leadsto']),
+        required=tuple(LinkRecord(**link) for link in value['required']),
+        prereqs=tuple(_entry_from_json(entry) for entry in value['prereqs']),
+        rewards=tuple(_entry_from_json(entry) for entry in value['rewards']),
+        embed=value['embed'],
+    )
+
+def _wrap_value(value: LinkRecord | str | None):
+    return Hyperlink(value) if isinstance(value, LinkRecord) else value
 
 class Mission:
+    __slots__ = ('_record', '_prereqs', '_rewards')
+
     @staticmethod
     def request(url: str | bytes, *, timeout=-1, session: requests.Session = ...) -> 'Mission | None':
-        info_box = Mission._try_get_infobox(url, timeout=timeout, session=session)
-        if info_box is None:
+        record = Mission.request_record(url, timeout=timeout, session=session)
+        if record is None:
             return None
-        return Mission(url, info_box=info_box)
+        return Mission(url, record=record)
 
     @staticmethod
-    def _try_get_infobox(url: str | bytes, *, timeout=-1, session: requests.Session = None):
-        if '://' not in url:
-            url = urllib.parse.urljoin(_base_url, url)
-        if session is None:
-            response = requests.get(url, timeout=timeout)
-        else:
-            response = session.get(url, timeout=timeout)
-        response.raise_for_status()
-        mission_strainer = SoupStrainer('div', class_='xcx mission')
-        soup = BeautifulSoup(response.content, builder=_builder)
-        return soup.find(mission_strainer)
-
-    def __init__(self, url: str | bytes, *, info_box: Tag = ...):
-        if info_box is ...:
-            info_box = Mission._try_get_infobox(url)
-        if info_box is None:
-            raise ValueError(f"'info_box' cannot be None and could not be found in '{url}'")
-        self._href = urllib.parse.urlparse(url).path
-        self._info_box = copy.deepcopy(info_box)
-
-    def _get_data_value_div(self, data_source: str):
-        tag = self._info_box.find('div', {'data-source': data_source}, class_='pi-data')
-        if tag is None:
-            return None
-        pi_data_value = tag.find('div', class_='pi-data-value')
-        return pi_data_value
+    def request_record(url: str | bytes, *, timeout=-1, session: requests.Session = ..., refresh=False) -> MissionRecord | None:
+        # Parsing needs bs4, which is only imported once a page is actually
+        # scraped so stored records can be used without it.
+        from missionparser import request_mission_record
+        return request_mission_record(url, timeout=timeout, session=None if session is ... else session, refresh=refresh)
 
-    def _get_data_value(self, data_source: str):
-        pi_data_value = self._get_data_value_div(data_source)
-        if pi_data_value is None:
-            return None
-        a = pi_data_value.find('a')
-        return Hyperlink(a) if a is not None else str(pi_data_value.get_text().strip())
-
-    def _get_data_value_list(self, data_source: str):
-        div = self._get_data_value_div(data_source)
-        if div is None:
-            return
-        temp_div = None
-        for child in div.contents:
-            if isinstance(child, Tag) and child.name == 'br':
-                if temp_div is not None:
-                    yield temp_div
-                temp_div = None
-                continue
-            if temp_div is None:
-                temp_div = div.copy_self()
-            temp_div.append(copy.deepcopy(child))
-        if temp_div is not None:
-            yield temp_div
+    def __init__(self, url: str | bytes, *, info_box: 'Tag' = ..., record: MissionRecord = ...):
+        if record is ...:
+            from missionparser import extract_mission_record, request_infobox
+            if info_box is ...:
+                info_box = request_infobox(url)
+            if info_box is None:
+                raise ValueError(f"'info_box' cannot be None and could not be found in '{url}'")
+            record = extract_mission_record(url, info_box)
+        self._record = record
+        self._prereqs = None
+        self._rewards = None
+
+    @property
+    def record(self):
+        return self._record
 
     @property
     def href(self):
-        return self._href
+        return self._record.href
 
     @property
     def name(self):
-        return self._info_box.find('h2', {'data-source': 'name'}).get_text()
+        return self._record.name
 
     @property
     def type(self):
-        nav = self._info_box.find('nav')
-        return nav.get_text().strip() if nav else None
+        return self._record.type
 
     @property
     def type_enum(self):
@@ -88,57 +120,45 @@ class Mission:
 
     @property
     def summary(self):
-        return self._get_data_value('summary')
+        return _wrap_value(self._record.summary)
 
     @property
     def client(self):
-        return self._get_data_value('client')
+        return _wrap_value(self._record.client)
 
     @property
     def location(self):
-        return self._get_data_value('location')
+        return _wrap_value(self._record.location)
 
     @property
     def difficulty(self):
-        value = self._get_data_value('difficulty')
-        return value.strip('-').strip() if value else value
+        return _wrap_value(self._record.difficulty)
 
     @property
     def required(self):
-        div = self._get_data_value_div('required')
-        if div is None:
-            return []
-        return [ Hyperlink(a) for a in div.find_all('a') ]
+        return [ Hyperlink(link) for link in self._record.required ]
 
     @property
     def leadsto(self):
-        return self._get_data_value('leadsto')
+        return _wrap_value(self._record.leadsto)
 
     @property
     def prereqs(self):
-        client = self.client
-        return [ Prerequisite(element, client) for element in self._get_data_value_list('prereqs') ]
+        if self._prereqs is None:
+            client = self.client
+            self._prereqs = [ Prerequisite(entry, client) for entry in self._record.prereqs ]
+        return self._prereqs
 
     @property
     def rewards(self):
-        client = self.client
-        return [ Reward(element, client) for element in self._get_data_value_list('rewards') ]
+        if self._rewards is None:
+            client = self.client
+            self._rewards = [ Reward(entry, client) for entry in self._record.rewards ]
+        return self._rewards
 
     @property
     def embed(self):
-        embed = copy.deepcopy(self._info_box)
-        h2 = embed.find('h2', {'data-source': 'name'})
-        BeautifulSoup().new_tag('a')
-        new_a = Tag(name='a', attrs={'href': self.href}, builder=_builder)
-        for content in reversed(h2.contents):
-            new_a.insert(0, content.extract())
-        h2.insert(0, new_a)
-        for a in embed.find_all('a'):
-            a['target'] = '_blank'
-        aside = embed.find('aside', class_='portable-infobox')
-        if aside:
-            aside['style'] = 'margin: 0px'
-        return embed.decode()
+        return self._record.embed
 
     def __repr__(self):
         return f"Mission('{self.href}')"
@@ -158,138 +178,65 @@ f"""Mission('{self.href}')
 """
 
 class Hyperlink:
-    def __init__(self, element: Tag):
-        self._element = element
+    __slots__ = ('href', 'title', 'text', 'string')
 
-    @property
-    def href(self) -> str:
-        return self._element['href']
-
-    @property
-    def title(self) -> str:
-        return self._element['title']
-
-    @property
-    def text(self) -> str:
-        return self._element.text
-
-    @property
-    def string(self) -> str:
-        return self._element.string
+    def __init__(self, link: LinkRecord):
+        self.href = link.href
+        self.title = link.title
+        self.text = link.text
+        self.string = link.string
 
     def __repr__(self):
-        return repr(self._element)
-        #return f'<Mission "{self.name}">'
+        return f"Hyperlink('{self.href}')"
 
+# Prerequisites and rewards are parsed once when they are created, build_graph
+# reads their fields many times per mission
 class Prerequisite:
-    def __init__(self, element: Tag, client: Hyperlink = None):
-        self._element = element
-        self._client = client
-
-    def _single_a(self):
-        all_a = self._element.find_all('a')
-        if len(all_a) != 1:
-            return None
-        return all_a[0]
-
-    @property
-    def href(self):
-        a = self._single_a()
-        if a and a['title'] != 'Cross':
-            return str(a['href'])
-        if self.is_affinity and self._client and self._client.text in self._element.text:
-            return self._client.href
-        return None
-
-    @property
-    def title(self):
-        a = self._single_a()
-        if a and a['title'] != 'Cross':
-            return str(a['title'])
-        if self.is_affinity and self._client and self._client.text in self._element.text:
-            return self._client.title
-        return None
-
-    @property
-    def text(self):
-        if self.is_affinity:
-            return self._element.text.replace('Cross-', '')
-        return self._element.text
-
-    @property
-    def is_mission(self):
-        a = self._single_a()
-        if a is None:
-            return False
-        return self._element.text == a.text
-
-    @property
-    def is_affinity(self):
-        if '♥' in self._element.text or 'affinity' in self._element.text:
-            return True
-        return False
+    __slots__ = ('_entry', 'href', 'title', 'text', 'is_mission', 'is_affinity')
+
+    def __init__(self, entry: EntryRecord, client: Hyperlink = None):
+        self._entry = entry
+        a = entry.links[0] if len(entry.links) == 1 else None
+        self.is_affinity = '♥' in entry.text or 'affinity' in entry.text
+        self.is_mission = a is not None and entry.text == a.text
+        self.text = entry.text.replace('Cross-', '') if self.is_affinity else entry.text
+        if a and a.title != 'Cross':
+            self.href, self.title = a.href, a.title
+        elif self.is_affinity and isinstance(client, Hyperlink) and client.text in entry.text:
+            self.href, self.title = client.href, client.title
+        else:
+            self.href, self.title = None, None
 
     @property
     def embed(self):
-        embed = copy.deepcopy(self._element)
-        for a in embed.find_all('a'):
-            a['target'] = '_blank'
-        return embed.decode()
+        return self._entry.embed
 
     def __str__(self):
         return self.text
 
     def __repr__(self):
-        return f'Prerequisite(\'{self._element!r}\')'
+        return f'Prerequisite(\'{self._entry.embed}\')'
 
 class Reward:
-    def __init__(self, element: Tag, client: Hyperlink = None):
-        self._element = element
-        self._client = client
+    __slots__ = ('_entry', 'href', 'title', 'text', 'unlocks_recruits', 'recruits')
 
-    def _single_a(self):
-        all_a = self._element.find_all('a')
-        if len(all_a) != 1:
-            return None
-        return all_a[0]
-
-    @property
-    def href(self):
-        a = self._single_a()
-        return str(a['href']) if a else None
-
-    @property
-    def title(self):
-        a = self._single_a()
-        return str(a['title']) if a else None
-
-    @property
-    def text(self):
-        return self._element.text
-
-    @property
-    def unlocks_recruits(self):
-        if 'recruit' in self.text or 'join' in self.text:
-            return True
-        return False
-
-    @property
-    def recruits(self):
-        if not self.unlocks_recruits:
-            return None
-        return [ Hyperlink(a) for a in self._element.find_all('a') ] or [self._client]
+    def __init__(self, entry: EntryRecord, client: Hyperlink = None):
+        self._entry = entry
+        a = entry.links[0] if len(entry.links) == 1 else None
+        self.href = a.href if a else None
+        self.title = a.title if a else None
+        self.text = entry.text
+        self.unlocks_recruits = 'recruit' in entry.text or 'join' in entry.text
+        self.recruits = ([ Hyperlink(link) for link in entry.links ] or [client]) if self.unlocks_recruits else None
 
     @property
     def embed(self):
-        embed = copy.deepcopy(self._element)
-        for a in embed.find_all('a'):
-            a['target'] = '_blank'
-        return embed.decode()
+        return self._entry.embed
 
     def __str__(self):
         return self.text
 
     def __repr__(self):
-        return f'Reward(\'{self._element!r}\')'
+        return f'Reward(\'{self._entry.embed}\')'
 
 HyperlinkLike = Hyperlink | Prerequisite | Reward
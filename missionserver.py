@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+import networkx as nx
+
+from missiongraph import build_graph, make_graph_network, render_html
+from missionquery import MissionGraph
+from missionstore import MissionStore
+
+class GraphState(NamedTuple):
+    version: int
+    graph: nx.DiGraph
+    mission_graph: MissionGraph
+
+class LRUCache:
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        # Computed outside the lock, two requests for the same key may
+        # both render it but neither blocks unrelated requests
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class QueryError(Exception):
+    pass
+
+class MissionService:
+    def __init__(self, store_path='.mission_store.sqlite', *, cache_size=128, reload_interval=5.0):
+        self.store_path = store_path
+        self.cache = LRUCache(cache_size)
+        self.reload_interval = reload_interval
+        self._stamp = None
+        self.state: GraphState = None
+        self.reload()
+
+    def _store_stamp(self):
+        # The WAL file changes on every write, the main file only on checkpoints
+        return tuple(os.stat(path).st_mtime_ns if os.path.exists(path) else None
+                     for path in (self.store_path, self.store_path + '-wal'))
+
+    def reload(self):
+        stamp = self._store_stamp()
+        with MissionStore(self.store_path, readonly=True) as store:
+            graph = build_graph(source=store.missions())
+        version = (self.state.version + 1) if self.state is not None else 1
+        # Requests in flight keep using the state they started with, new ones
+        # see the new graph as soon as this single assignment happens
+        self.state = GraphState(version, graph, MissionGraph.from_graph(graph))
+        self._stamp = stamp
+        self.cache.clear()
+
+    def watch(self):
+        def run():
+            while True:
+                time.sleep(self.reload_interval)
+                if self._store_stamp() == self._stamp:
+                    continue
+                try:
+                    self.reload()
+                    print(f'Reloaded {self.store_path} (version {self.state.version})', file=sys.stderr)
+                except Exception as e:
+                    # Keep serving the previous graph, e.g. while the store is being rebuilt
+                    print(f'Reloading {self.store_path} failed: {e!r}', file=sys.stderr)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    @staticmethod
+    def _resolve(mission_graph: MissionGraph, name: str):
+        try:
+            return mission_graph.resolve(name)
+        except KeyError:
+            raise QueryError(f"unknown mission '{name}'")
+
+    def _describe(self, state: GraphState, nodes: list[str]):
+        return [ { 'href': node, **state.mission_graph.attributes[state.mission_graph.index[node]] } for node in nodes ]
+
+    def select_nodes(self, state: GraphState, params: dict[str, str]) -> set[str]:
+        graph, mission_graph = state.graph, state.mission_graph
+        if 'mission' in params:
+            nodes = { self._resolve(mission_graph, params['mission']) }
+        elif 'chapter' in params:
+            # The chapter's story missions and everything unlocked by them
+            # that isn't unlocked by a later chapter
+            chapters = { node for node, data in graph.nodes.data()
+                         if data.get('type') == 'story' and (data.get('name') == f"Chapter {params['chapter']}"
+                                                            or data.get('name', '').startswith(f"Chapter {params['chapter']} (")) }
+            if not chapters:
+                raise QueryError(f"unknown chapter '{params['chapter']}'")
+            nodes = set(chapters)
+            for chapter in chapters:
+                nodes.update(mission_graph.unlocks(chapter))
+            for later in [ node for node in nodes if node not in chapters and graph.nodes[node].get('type') == 'story' ]:
+                nodes.discard(later)
+                nodes.difference_update(mission_graph.unlocks(later))
+            nodes |= chapters
+        elif 'client' in params or 'location' in params:
+            key = 'client' if 'client' in params else 'location'
+            nodes = { node for node, value in graph.nodes.data(key) if value is not None and value.casefold() == params[key].casefold() }
+            if not nodes:
+                raise QueryError(f"no missions with {key} '{params[key]}'")
+        else:
+            raise QueryError('one of mission, chapter, client or location is required')
+
+        expand = params.get('expand', 'prereqs' if 'mission' in params else 'none')
+        if expand not in ('none', 'prereqs', 'unlocks', 'both'):
+            raise QueryError(f"expand must be none, prereqs, unlocks or both, not '{expand}'")
+        for node in [*nodes]:
+            if expand in ('prereqs', 'both'):
+                nodes.update(mission_graph.prerequisites(node))
+            if expand in ('unlocks', 'both'):
+                nodes.update(mission_graph.unlocks(node))
+        return nodes
+
+    def subgraph(self, state: GraphState, params: dict[str, str]) -> nx.DiGraph:
+        return state.graph.subgraph(self.select_nodes(state, params)).copy()
+
+    def query(self, path: str, params: dict[str, str]):
+        state = self.state
+        mission_graph = state.mission_graph
+        if path == '/health':
+            return 'application/json', { 'version': state.version, 'nodes': len(mission_graph),
+                                         'cache_hits': self.cache.hits, 'cache_misses': self.cache.misses }
+        if path in ('/prereqs', '/unlocks'):
+            if 'mission' not in params:
+                raise QueryError('mission is required')
+            mission = self._resolve(mission_graph, params['mission'])
+            nodes = mission_graph.prerequisites(mission) if path == '/prereqs' else mission_graph.unlocks(mission)
+            return 'application/json', { 'mission': mission, 'nodes': self._describe(state, nodes) }
+        if path == '/path':
+            if 'source' not in params or 'target' not in params:
+                raise QueryError('source and target are required')
+            source = self._resolve(mission_graph, params['source'])
+            target = self._resolve(mission_graph, params['target'])
+            nodes = mission_graph.shortest_path(source, target)
+            return 'application/json', { 'source': source, 'target': target,
+                                         'path': self._describe(state, nodes) if nodes is not None else None }
+        if path in ('/subgraph', '/render'):
+            # Rendered pages are cached per graph version and query
+            key = (state.version, path, tuple(sorted(params.items())))
+            if path == '/subgraph':
+                return 'application/json', self.cache.get(key, lambda: self._subgraph_json(state, params))
+            return 'text/html; charset=utf-8', self.cache.get(key, lambda: self._render(state, params))
+        return None
+
+    def _subgraph_json(self, state: GraphState, params: dict[str, str]):
+        subgraph = self.subgraph(state, params)
+        return {
+            'nodes': self._describe(state, sorted(subgraph)),
+            'edges': [ { 'from': u, 'to': v, **({ 'label': data['label'] } if 'label' in data else {}) }
+                       for u, v, data in sorted(subgraph.edges.data(), key=lambda edge: edge[:2]) ],
+        }
+
+    def _render(self, state: GraphState, params: dict[str, str]):
+        return render_html(make_graph_network(self.subgraph(state, params)), compact=params.get('compact', '1') != '0')
+
+def make_handler(service: MissionService):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            params = dict(urllib.parse.parse_qsl(url.query))
+            try:
+                result = service.query(url.path, params)
+            except QueryError as e:
+                return self._send(400, 'application/json', { 'error': str(e) })
+            except Exception as e:
+                # Without a response the client would wait for the body of a
+                # kept alive connection until it times out
+                print(f'{self.path} failed: {e!r}', file=sys.stderr)
+                return self._send(500, 'application/json', { 'error': 'internal error' })
+            if result is None:
+                return self._send(404, 'application/json', { 'error': f"no such endpoint '{url.path}'" })
+            self._send(200, *result)
+
+        def _send(self, status: int, content_type: str, body):
+            if not isinstance(body, str):
+                body = json.dumps(body, ensure_ascii=False)
+            data = body.encode('utf8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def serve(store_path='.mission_store.sqlite', host='127.0.0.1', port=8080, *, cache_size=128, reload_interval=5.0):
+    service = MissionService(store_path, cache_size=cache_size, reload_interval=reload_interval)
+    if reload_interval:
+        service.watch()
+    return ThreadingHTTPServer((host, port), make_handler(service))
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Serve mission graph queries and rendered subgraphs over HTTP')
+    parser.add_argument('--store', default='.mission_store.sqlite', help='mission store to load the graph from')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cache-size', type=int, default=128, help='number of rendered subgraphs to keep')
+    parser.add_argument('--reload-interval', type=float, default=5.0,
+                        help='seconds between checks for changes to the store, 0 to disable')
+    args = parser.parse_args(argv)
+    server = serve(args.store, args.host, args.port, cache_size=args.cache_size, reload_interval=args.reload_interval)
+    print(f"Serving '{args.store}' on http://{args.host}:{args.port}/", file=sys.stderr)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import hashlib
+import pathlib
+import sqlite3
+from typing import NamedTuple
+
+from missions import Mission, MissionRecord, record_from_json, record_schema_version, record_to_json
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+def extraction_version() -> str:
+    # Besides the explicit record schema version, any edit to the extraction
+    # code invalidates the store. The parser source is hashed rather than
+    # imported so reading the store never needs bs4 or lxml.
+    parser_source = pathlib.Path(__file__).with_name('missionparser.py').read_bytes()
+    return f'{record_schema_version}:{content_hash(parser_source)[:16]}'
+
+class StoredMission(NamedTuple):
+    href: str
+    title: str
+    revision_id: int | None
+    body_hash: str | None
+    record: MissionRecord | None
+
+class MissionStore:
+    def __init__(self, path='.mission_store.sqlite', *, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        if readonly:
+            self._connection = sqlite3.connect(f'{pathlib.Path(path).absolute().as_uri()}?mode=ro', uri=True)
+            return
+        self._connection = sqlite3.connect(path)
+        # WAL lets scraper workers read the store while the parent is writing to it
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        row = self._connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        version = extraction_version()
+        if row is None or row[0] != version:
+            self._connection.execute('DROP TABLE IF EXISTS missions')
+            self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (version,))
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS missions (
+                href TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                revision_id INTEGER,
+                body_hash TEXT,
+                record TEXT
+            )
+        ''')
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if not self.readonly:
+            self._connection.commit()
+        self._connection.close()
+
+    def commit(self):
+        self._connection.commit()
+
+    def get(self, href: str) -> StoredMission | None:
+        row = self._connection.execute(
+            'SELECT href, title, revision_id, body_hash, record FROM missions WHERE href = ?', (href,)
+        ).fetchone()
+        return self._from_row(row) if row else None
+
+    def get_by_content(self, href: str, body_hash: str) -> StoredMission | None:
+        row = self._connection.execute(
+            'SELECT href, title, revision_id, body_hash, record FROM missions WHERE href = ? AND body_hash = ?',
+            (href, body_hash)
+        ).fetchone()
+        return self._from_row(row) if row else None
+
+    def put(self, href: str, title: str, record: MissionRecord | None, revision_id: int | None = None,
+            body_hash: str | None = None):
+        # A None record remembers pages without a mission infobox, so they
+        # are not parsed again until their content changes.
+        self._connection.execute(
+            'INSERT OR REPLACE INTO missions (href, title, revision_id, body_hash, record) VALUES (?, ?, ?, ?, ?)',
+            (href, title, revision_id, body_hash, record_to_json(record) if record is not None else None)
+        )
+
+    def hrefs(self) -> list[str]:
+        return [ href for href, in self._connection.execute('SELECT href FROM missions') ]
+
+    def __iter__(self):
+        for row in self._connection.execute('SELECT href, title, revision_id, body_hash, record FROM missions'):
+            yield self._from_row(row)
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM missions').fetchone()[0]
+
+    def missions(self):
+        for stored in self:
+            if stored.record is not None:
+                yield (stored.title, Mission(stored.href, record=stored.record))
+
+    @staticmethod
+    def _from_row(row):
+        href, title, revision_id, body_hash, record = row
+        return StoredMission(href, title, revision_id, body_hash, record_from_json(record) if record is not None else None)
@@ -0,0 +1,171 @@
+import math
+import os
+import re
+from collections import Counter
+import networkx as nx
+
+from missiongraph import make_graph_network, make_network, render_html
+from missionquery import MissionGraph
+from timings import timings
+from viewer import write_viewer
+
+# Double clicking a node with a 'page' opens that page, hovering it already
+# fetches the page's payload so the browser has it cached by the click.
+navigation_script = '''
+        <script type="text/javascript">
+            (function () {
+                var prefetched = {};
+
+                function pageUrl(node) {
+                    return new URL(node.page, location.href);
+                }
+
+                function prefetch(node) {
+                    var url = pageUrl(node).href;
+                    if (prefetched[url]) {
+                        return;
+                    }
+                    prefetched[url] = true;
+                    fetch(new URL('graph.json', url), { cache: 'no-cache' })
+                        .then(function (response) { return response.json(); })
+                        .then(function (manifest) { return fetch(new URL(manifest.payload, url)); })
+                        .catch(function () {});
+                }
+
+                function followPages() {
+                    network.on('hoverNode', function (params) {
+                        var node = nodes.get(params.node);
+                        if (node && node.page) {
+                            prefetch(node);
+                        }
+                    });
+                    network.on('doubleClick', function (params) {
+                        var node = params.nodes.length ? nodes.get(params.nodes[0]) : null;
+                        if (node && node.page) {
+                            location.href = pageUrl(node);
+                        }
+                    });
+                }
+
+                if (network) {
+                    followPages();
+                } else {
+                    document.addEventListener('graphload', followPages);
+                }
+            })();
+        </script>
+'''
+
+def _chapter_number(data: dict):
+    return int(data['name'].replace('Chapter ', '')[:2])
+
+def chapter_partitions(graph: nx.DiGraph) -> dict[str, str]:
+    # A node belongs to the latest chapter it depends on, i.e. the chapter
+    # during which it becomes available
+    mission_graph = MissionGraph.from_graph(graph)
+    chapters = { node: _chapter_number(data) for node, data in graph.nodes.data() if data.get('type') == 'story' }
+    partitions = {}
+    for node in graph:
+        numbers = [ chapters[ancestor] for ancestor in mission_graph.prerequisites(node) if ancestor in chapters ]
+        if node in chapters:
+            numbers.append(chapters[node])
+        partitions[node] = f'Chapter {max(numbers)}' if numbers else 'Before Chapter 1'
+    return partitions
+
+def location_partitions(graph: nx.DiGraph) -> dict[str, str]:
+    partitions = { node: location for node, location in graph.nodes.data('location') if location not in (None, 'None') }
+    # Characters and other prerequisites go where most of their neighbours are
+    for node in graph:
+        if node in partitions:
+            continue
+        neighbours = Counter(partitions[neighbour] for neighbour in nx.all_neighbors(graph, node) if neighbour in partitions)
+        partitions[node] = min(neighbours, key=lambda key: (-neighbours[key], key)) if neighbours else 'Elsewhere'
+    return partitions
+
+def _slug(name: str, taken: set[str]):
+    slug = re.sub(r'[^a-z0-9]+', '-', name.casefold()).strip('-') or 'partition'
+    candidate, i = slug, 2
+    while candidate in taken:
+        candidate, i = f'{slug}-{i}', i + 1
+    taken.add(candidate)
+    return candidate
+
+def partition_subgraph(graph: nx.DiGraph, partitions: dict[str, str], name: str, slugs: dict[str, str]):
+    # The partition's nodes plus its boundary, which links to other pages:
+    # prerequisites from other partitions are shown one by one, while what
+    # the partition unlocks elsewhere is one node per partition, otherwise
+    # hubs like the chapters would pull in most of the graph.
+    members = { node for node, partition in partitions.items() if partition == name }
+    prerequisites = { predecessor for node in members for predecessor in graph.predecessors(node) if predecessor not in members }
+    subgraph = graph.subgraph(members | prerequisites).copy()
+    subgraph.remove_edges_from([ (u, v) for u, v in subgraph.edges if u in prerequisites and v in prerequisites ])
+    for node in prerequisites:
+        subgraph.add_node(
+            node,
+            page=f'../{slugs[partitions[node]]}/',
+            label=f"{subgraph.nodes[node].get('label', node)} ({partitions[node]})",
+            shape='diamond',
+            physics=True,
+            fixed=False,
+        )
+        subgraph.nodes[node].pop('x', None)
+
+    unlocked: Counter[str] = Counter()
+    for node in members:
+        for successor in graph.successors(node):
+            if successor in subgraph:
+                continue
+            other = f'partition:{partitions[successor]}'
+            unlocked[other] += 1
+            subgraph.add_edge(node, other, dashes=True)
+    for other, count in unlocked.items():
+        partition = other.removeprefix('partition:')
+        subgraph.add_node(
+            other,
+            page=f'../{slugs[partition]}/',
+            label=f'{partition} ({count})',
+            title=f'Unlocks {count} more in {partition}',
+            group='other',
+            shape='diamond',
+        )
+    return subgraph
+
+def overview_graph(graph: nx.DiGraph, partitions: dict[str, str], slugs: dict[str, str]):
+    sizes = Counter(partitions.values())
+    overview = nx.DiGraph()
+    for name, size in sizes.items():
+        overview.add_node(
+            name,
+            label=f'{name}\n{size} nodes',
+            page=f'{slugs[name]}/',
+            group='other',
+            shape='box',
+            size=6 + 2 * math.sqrt(size),
+        )
+    crossings: Counter[tuple[str, str]] = Counter()
+    for u, v in graph.edges:
+        if partitions[u] != partitions[v]:
+            crossings[partitions[u], partitions[v]] += 1
+    for (u, v), count in crossings.items():
+        overview.add_edge(u, v, title=f'{count} edges', width=1 + math.log2(count))
+    return overview
+
+def _write_page(net, directory: str, compact: bool):
+    html = render_html(net, compact=compact)
+    body_end = html.rindex('</body>')
+    html = html[:body_end] + navigation_script + html[body_end:]
+    return write_viewer(html, directory)
+
+def write_partitions(graph: nx.DiGraph, directory: str, by='chapter', *, compact=False, static_layout=False):
+    partitions = chapter_partitions(graph) if by == 'chapter' else location_partitions(graph)
+    taken = set()
+    slugs = { name: _slug(name, taken) for name in sorted(set(partitions.values())) }
+
+    written = []
+    for name, slug in slugs.items():
+        with timings.span('partitions.page'):
+            subgraph = partition_subgraph(graph, partitions, name, slugs)
+            written += _write_page(make_graph_network(subgraph, static_layout), os.path.join(directory, slug), compact)
+    with timings.span('partitions.overview'):
+        written += _write_page(make_network(overview_graph(graph, partitions, slugs)), directory, compact)
+    return written
@@ -1,85 +1,491 @@
+import json
+import multiprocessing
+import os
 import sys
+import time
 import traceback
 import urllib.parse
 import requests
 import requests_cache
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, BrokenExecutor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from collections import OrderedDict
+from functools import partial
+from itertools import islice
+from typing import Iterable, NamedTuple
 from bs4 import BeautifulSoup
 
-from missions import Mission
+from checkpoint import ScrapeCheckpoint
+from missionparser import extract_mission_record, find_batch_infoboxes, parse_mission_record, request_page
+from missions import Mission, MissionRecord
+from missionstore import MissionStore, content_hash
+from httpcache import CachePolicy, PolicySession, default_cache_path, merge_accessed, take_accessed
+from snapshot import ReplaySession
+from timings import count_cache_response, timings
+from wikiapi import find_template, max_titles_per_request, query_revision_ids, query_wikitext, render_templates, standalone_template
 
 base_url = 'https://xenoblade.fandom.com/'
+missions_category_url = '/wiki/Category:XCX_Missions'
+# Responses worth asking again for, anything else fails the page at once
+retry_status_codes = { 429, 500, 502, 503, 504 }
+
+class ScrapeResult(NamedTuple):
+    record: MissionRecord | None
+    body_hash: str | None
+    error: str | None
+    attempts: int
+
+class ScrapeFailure(NamedTuple):
+    url: str
+    title: str
+    error: str
+    attempts: int
+    # The page's previous record from the mission store was used instead
+    stale: bool = False
 
 def make_session():
-    return requests_cache.CachedSession('.requests_cache', ignored_parameters=['Cookie'])
+    # Set by use_snapshot and use_cache_policy, environment variables so pool workers inherit them
+    snapshot_path = os.environ.get('XCX_SNAPSHOT')
+    if snapshot_path:
+        return ReplaySession(snapshot_path)
+    policy = os.environ.get('XCX_CACHE_POLICY')
+    return PolicySession(default_cache_path, CachePolicy.from_json(policy) if policy else CachePolicy(),
+                         ignored_parameters=['Cookie'])
 session = make_session()
 
-def request_soup(url: str | bytes, session_: requests.Session = ...):
+# Pools are started while the category crawl threads may be holding
+# SQLite or urllib3 locks, a forked worker could inherit them locked
+pool_context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                                           else 'spawn')
+
+def _session_environment():
+    return { name: os.environ.get(name) for name in ('XCX_SNAPSHOT', 'XCX_CACHE_POLICY') }
+
+def _init_worker(environment: dict[str, str | None]):
+    # Workers come from the fork server, whose environment is from when it
+    # started, so the parent's current session settings are passed along
+    global session
+    for name, value in environment.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+    session = make_session()
+
+def use_snapshot(path: str):
+    global session
+    os.environ['XCX_SNAPSHOT'] = path
+    session = make_session()
+
+def use_cache_policy(policy: CachePolicy):
+    global session
+    os.environ['XCX_CACHE_POLICY'] = policy.to_json()
+    session = make_session()
+
+def maintain_http_cache():
+    # Evicts and compacts the HTTP cache, once the scrape is done
+    if isinstance(session, PolicySession):
+        return session.maintain()
+    return None
+
+def absolute_url(url: str | bytes):
     if '://' not in url:
         url = urllib.parse.urljoin(base_url, url)
+    return url
+
+def is_category_title(title: str):
+    return title.startswith('Category:')
+
+def request_soup(url: str | bytes, session_: requests.Session = ..., *, refresh=False):
+    url = absolute_url(url)
     if session_ is ...:
         session_ = session
-    response = session_.get(url, timeout=5)
+    if refresh and isinstance(session_, requests_cache.CachedSession):
+        response = session_.get(url, timeout=5, force_refresh=True)
+    else:
+        response = session_.get(url, timeout=5)
+    count_cache_response(response)
     response.raise_for_status()
     soup = BeautifulSoup(response.content, 'lxml')
     return soup
 
-def scrape_category_page_links(url: str | bytes):
-    soup = request_soup(url)
+def scrape_category_page_links(url: str | bytes, *, refresh=False):
+    # Follow the "next page" links, large categories are split over several pages
     links: OrderedDict[str, str] = OrderedDict()
-    for a in soup.find_all('a', class_='category-page__member-link'):
-        links[a['href']] = a['title']
+    visited = set()
+    while url is not None and absolute_url(url) not in visited:
+        visited.add(absolute_url(url))
+        page_links, url = parse_category_page(request_soup(url, refresh=refresh))
+        links.update(page_links)
     return links
 
-def scrape_subcategory_page_links(url: str | bytes):
-    subcategory_pages = scrape_category_page_links(url)
-    
-    extra_subcategory_pages = {}
-    for subcategory_page_url in subcategory_pages.keys():
-        extra_subcategory_pages.update(scrape_category_page_links(subcategory_page_url))
-    subcategory_pages.update(extra_subcategory_pages)
-    
+def parse_category_page_links(soup: BeautifulSoup | str | bytes):
+    return parse_category_page(soup)[0]
+
+def parse_category_page(soup: BeautifulSoup | str | bytes) -> tuple[OrderedDict[str, str], str | None]:
+    if not isinstance(soup, BeautifulSoup):
+        soup = BeautifulSoup(soup, 'lxml')
     links: OrderedDict[str, str] = OrderedDict()
-    for subcategory_page_url, title in subcategory_pages.items():
-        if not title.startswith('Category:'):
-            continue
-        links.update(scrape_category_page_links(subcategory_page_url))
-    return links
+    for a in soup.find_all('a', class_='category-page__member-link'):
+        links[a['href']] = a['title']
+    next_a = soup.find('a', class_='category-page__pagination-next')
+    return links, next_a['href'] if next_a is not None else None
+
+def scrape_subcategory_page_links(url: str | bytes, *, max_depth=2, max_workers=8, refresh=False):
+    return OrderedDict(iter_subcategory_page_links(url, max_depth=max_depth, max_workers=max_workers, refresh=refresh))
+
+def iter_subcategory_page_links(url: str | bytes, *, max_depth=2, max_workers=8, refresh=False):
+    # Pages are collected from subcategories up to max_depth below url.
+    # Every category of one level is fetched in parallel, and the pages a
+    # category lists are yielded as soon as it arrives, so they can be
+    # scraped while the rest of the categories are still being crawled.
+    visited = { absolute_url(url) }
+    seen = set()
+    level = [url]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for depth in range(max_depth + 1):
+            next_level = []
+            category_pages = executor.map(partial(scrape_category_page_links, refresh=refresh), level)
+            while True:
+                with timings.span('scrape.category_crawl'):
+                    category_links = next(category_pages, None)
+                if category_links is None:
+                    break
+                for href, title in category_links.items():
+                    if is_category_title(title):
+                        if absolute_url(href) not in visited:
+                            visited.add(absolute_url(href))
+                            next_level.append(href)
+                    elif depth > 0 and href not in seen:
+                        seen.add(href)
+                        yield href, title
+            level = next_level
+            if not level:
+                break
 
 def scrape_mission(url: str | bytes):
     return Mission.request(url, timeout=5, session=session)
 
+def scrape_mission_record(url: str | bytes, refresh=False, store: MissionStore = None) -> tuple[MissionRecord | None, str]:
+    # Pages whose body is unchanged since they were last parsed are served
+    # from the mission store instead of being parsed again.
+    content = request_page(url, timeout=5, session=session, refresh=refresh)
+    body_hash = content_hash(content)
+    if store is not None:
+        stored = store.get_by_content(urllib.parse.urlparse(url).path, body_hash)
+        if stored is not None:
+            return stored.record, body_hash
+    return parse_mission_record(url, content), body_hash
+
+def _is_transient(error: Exception):
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in retry_status_codes
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+def scrape_mission_record_retrying(url: str | bytes, refresh=False, store: MissionStore = None, *,
+                                   retries=2, retry_delay=1.0) -> ScrapeResult:
+    # Timeouts, dropped connections and 5xx are tried again with exponential
+    # backoff. Whatever still fails, like a page the parser chokes on, is
+    # returned as an error so it only costs that one page.
+    for attempt in range(retries + 1):
+        try:
+            record, body_hash = scrape_mission_record(url, refresh, store)
+            return ScrapeResult(record, body_hash, None, attempt + 1)
+        except Exception as e:
+            if attempt == retries or not _is_transient(e):
+                return ScrapeResult(None, None, f'{type(e).__name__}: {e}', attempt + 1)
+        time.sleep(retry_delay * 2**attempt)
+
+def scrape_mission_records(urls: list[str], refresh=False, store_path: str = None, *, retries=2, retry_delay=1.0):
+    scrape = partial(scrape_mission_record_retrying, refresh=refresh, retries=retries, retry_delay=retry_delay)
+    if store_path is None:
+        return [ scrape(url) for url in urls ]
+    with MissionStore(store_path, readonly=True) as store:
+        return [ scrape(url, store=store) for url in urls ]
+
+def _scrape_mission_records_counted(urls: list[str], refresh=False, store_path: str = None, retries=2, retry_delay=1.0):
+    # Runs in a pool worker, so the cache counters and access times are sent back with the results
+    timings.counters.clear()
+    results = scrape_mission_records(urls, refresh, store_path, retries=retries, retry_delay=retry_delay)
+    return results, dict(timings.counters), take_accessed(session)
+
+def _chunked(items: Iterable, size: int):
+    # Lazy, so a long iterable is never copied whole
+    items = iter(items)
+    while chunk := [*islice(items, size)]:
+        yield chunk
+
+def _log_mission(mission: Mission):
+    try:
+        #print(f'{mission!r} "{mission.name}"')
+        print(mission.details())
+    except:
+        print(f'{traceback.format_exc()}{mission!r}:\n{mission.record}', file=sys.stderr)
+
 def scrape_all_missions(slice_=slice(None, None), *, log=False):
-    mission_links = scrape_subcategory_page_links('https://xenoblade.fandom.com/wiki/Category:XCX_Missions')
+    mission_links = scrape_subcategory_page_links(missions_category_url)
     for mission_url, mission_title in [*mission_links.items()][slice_]:
         mission = scrape_mission(mission_url)
         if mission is None:
             continue
         if log:
+            _log_mission(mission)
+        yield (mission_title, mission)
+
+def _store_record(store: MissionStore, mission_url: str, mission_title: str, record: MissionRecord | None,
+                  body_hash: str | None, revision_ids: dict[str, int] = None):
+    href = urllib.parse.urlparse(mission_url).path
+    if revision_ids is not None:
+        revision_id = revision_ids.get(mission_title)
+    else:
+        previous = store.get(href)
+        unchanged = previous is not None and previous.body_hash == body_hash
+        revision_id = previous.revision_id if unchanged else None
+    store.put(href, mission_title, record, revision_id, body_hash)
+
+def _failed_results(error: Exception, count: int, attempts=0):
+    return [ ScrapeResult(None, None, f'{type(error).__name__}: {error}', attempts) ] * count
+
+def _scrape_mission_records_concurrent(mission_links: Iterable[tuple[str, str]], *, max_workers=5, chunksize=8,
+                                       refresh=False, store: MissionStore = None,
+                                       revision_ids: dict[str, int] = None,
+                                       checkpoint: ScrapeCheckpoint = None, retries=2, retry_delay=1.0,
+                                       failures: list[ScrapeFailure] = None, max_in_flight: int = None, ordered=False):
+    # Workers only send back MissionRecords, never bs4 trees, and take
+    # several pages per task so the IPC overhead is paid once per chunk.
+    # Workers only read the store, all writes to it happen here in the
+    # parent. Pages in the checkpoint are not fetched again, unless they
+    # are being refreshed or the checkpoint has an older revision of them,
+    # pages that fail are left out and added to failures.
+    #
+    # At most max_in_flight chunks are submitted or finished but not yet
+    # yielded, new ones are only taken from mission_links as earlier ones
+    # are consumed, so memory doesn't grow with the category. Chunks are
+    # yielded as they complete, or with ordered in mission_links order,
+    # holding back the ones that finish before an earlier chunk.
+    store_path = store.path if store is not None else None
+    if max_in_flight is None:
+        max_in_flight = 2 * max_workers
+    # Anything less would end the scrape before the first page, as if the category were empty
+    if max_in_flight < 1:
+        raise ValueError(f'max_in_flight must be at least 1, not {max_in_flight}')
+    if chunksize < 1:
+        raise ValueError(f'chunksize must be at least 1, not {chunksize}')
+    chunks = enumerate(_chunked(mission_links, chunksize))
+    in_flight: dict[Future, tuple[int, list, list]] = {}
+    finished: dict[int, tuple[list, list, list[ScrapeResult]]] = {}
+    next_index = 0
+
+    def resume(mission_url: str, mission_title: str):
+        entry = checkpoint.get(mission_url) if checkpoint is not None else None
+        if entry is None:
+            return None
+        if revision_ids is not None:
+            revision_id = revision_ids.get(mission_title)
+            return entry if revision_id is not None and entry.revision_id == revision_id else None
+        return entry if not refresh else None
+
+    def fill(executor: ProcessPoolExecutor):
+        while len(in_flight) + len(finished) < max_in_flight:
+            index, chunk = next(chunks, (None, None))
+            if chunk is None:
+                return
+            done = [ resume(mission_url, mission_title) for mission_url, mission_title in chunk ]
+            urls = [ mission_url for (mission_url, _), entry in zip(chunk, done) if entry is None ]
+            if not urls:
+                finished[index] = (chunk, done, [])
+                continue
             try:
-                #print(f'{mission!r} "{mission.name}"')
-                print(mission.details())
-            except:
-                print(f'{traceback.format_exc()}{mission!r}:\n{mission._info_box}', file=sys.stderr)
+                task = executor.submit(_scrape_mission_records_counted, urls, refresh, store_path, retries, retry_delay)
+            except BrokenExecutor as e:
+                finished[index] = (chunk, done, _failed_results(e, len(urls)))
+                continue
+            in_flight[task] = (index, chunk, done)
+
+    def collect(task: Future, urls: int):
+        try:
+            results, counters, accessed = task.result()
+        except Exception as e:
+            # The worker itself died or its results couldn't be sent back
+            return _failed_results(e, urls)
+        timings.merge_counters(counters)
+        merge_accessed(session, accessed)
+        return results
+
+    def emit(chunk: list, done: list, results: list[ScrapeResult]):
+        results = iter(results)
+        for (mission_url, mission_title), entry in zip(chunk, done):
+            if entry is not None:
+                if store is not None:
+                    _store_record(store, mission_url, mission_title, entry.record, entry.body_hash, revision_ids)
+                yield (mission_url, mission_title, entry.record)
+                continue
+            result = next(results)
+            if result.error is not None:
+                # A page that was scraped before keeps its last good record,
+                # rather than one bad request taking it out of the graph
+                stored = store.get(urllib.parse.urlparse(mission_url).path) if store is not None else None
+                stale = stored is not None and stored.record is not None
+                print(f"Failed to scrape '{mission_url}' after {result.attempts} attempts: {result.error}"
+                      f"{', using the stored record' if stale else ''}", file=sys.stderr)
+                timings.count('scrape_failures')
+                if failures is not None:
+                    failures.append(ScrapeFailure(mission_url, mission_title, result.error, result.attempts, stale))
+                if stale:
+                    yield (mission_url, mission_title, stored.record)
+                continue
+            if store is not None:
+                _store_record(store, mission_url, mission_title, result.record, result.body_hash, revision_ids)
+            if checkpoint is not None:
+                checkpoint.add(mission_url, mission_title, result.body_hash, result.record,
+                               revision_ids.get(mission_title) if revision_ids is not None else None)
+            yield (mission_url, mission_title, result.record)
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=pool_context, initializer=_init_worker,
+                             initargs=(_session_environment(),)) as executor:
+        try:
+            fill(executor)
+            while in_flight or finished:
+                if in_flight:
+                    completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for task in completed:
+                        index, chunk, done = in_flight.pop(task)
+                        finished[index] = (chunk, done, collect(task, done.count(None)))
+                ready = [*finished] if not ordered else []
+                while ordered and next_index in finished:
+                    ready.append(next_index)
+                    next_index += 1
+                for index in ready:
+                    yield from emit(*finished.pop(index))
+                fill(executor)
+        except BaseException:
+            # Interrupted, the chunks that haven't started would only be thrown away
+            executor.shutdown(cancel_futures=True)
+            raise
+    if store is not None:
+        store.commit()
+
+def write_failure_report(failures: list[ScrapeFailure], path: str):
+    with open(path, 'w', encoding='utf8') as out:
+        json.dump([ failure._asdict() for failure in failures ], out, indent=2, ensure_ascii=False)
+
+def scrape_all_missions_concurrent(slice_=slice(None), *, max_workers=5, chunksize=8, store: MissionStore = None,
+                                   checkpoint: ScrapeCheckpoint = None, retries=2, failures: list[ScrapeFailure] = None,
+                                   max_in_flight: int = None, ordered=False, log=False):
+    # Missions stream from the category crawl straight into the pool
+    mission_links = iter_subcategory_page_links(missions_category_url)
+    if any(value is not None and value < 0 for value in (slice_.start, slice_.stop, slice_.step)):
+        mission_links = [*mission_links][slice_]
+    else:
+        mission_links = islice(mission_links, slice_.start, slice_.stop, slice_.step)
+    for mission_url, mission_title, record in _scrape_mission_records_concurrent(
+            mission_links, max_workers=max_workers, chunksize=chunksize, store=store,
+            checkpoint=checkpoint, retries=retries, failures=failures, max_in_flight=max_in_flight, ordered=ordered):
+        if record is None:
+            continue
+        mission = Mission(mission_url, record=record)
+        if log:
+            _log_mission(mission)
         yield (mission_title, mission)
 
-def scrape_all_missions_concurrent(slice_=slice(None), *, max_workers=5, log=False):
-    mission_links = scrape_subcategory_page_links('https://xenoblade.fandom.com/wiki/Category:XCX_Missions')
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        tasks = { executor.submit(scrape_mission, mission_url): mission_title
-                  for mission_url, mission_title in [*mission_links.items()][slice_] }
-        for task in as_completed(tasks):
-            mission: Mission = task.result()
-            if mission is None:
+def scrape_all_missions_incremental(store: MissionStore, slice_=slice(None), *, max_workers=5, chunksize=8,
+                                    checkpoint: ScrapeCheckpoint = None, retries=2, failures: list[ScrapeFailure] = None,
+                                    log=False):
+    # Only pages whose latest revision differs from the stored one are
+    # fetched again, everything else is served from the mission store.
+    mission_links = [*scrape_subcategory_page_links(missions_category_url, refresh=True).items()][slice_]
+    with timings.span('scrape.revision_ids'):
+        revision_ids = query_revision_ids([ mission_title for _, mission_title in mission_links ], session=session,
+                                          refresh=True)
+    changed_links = []
+    for mission_url, mission_title in mission_links:
+        stored = store.get(urllib.parse.urlparse(mission_url).path)
+        revision_id = revision_ids.get(mission_title)
+        if stored is None or revision_id is None or stored.revision_id != revision_id:
+            changed_links.append((mission_url, mission_title))
+        elif stored.record is not None:
+            yield (mission_title, Mission(mission_url, record=stored.record))
+
+    for mission_url, mission_title, record in _scrape_mission_records_concurrent(
+            changed_links, max_workers=max_workers, chunksize=chunksize, refresh=True,
+            store=store, revision_ids=revision_ids, checkpoint=checkpoint, retries=retries, failures=failures):
+        if record is None:
+            continue
+        mission = Mission(mission_url, record=record)
+        if log:
+            _log_mission(mission)
+        yield (mission_title, mission)
+
+def _scrape_mission_records_api(mission_links: list[tuple[str, str]], *, max_workers=5, chunksize=8,
+                                refresh=False, store: MissionStore = None, checkpoint: ScrapeCheckpoint = None,
+                                retries=2, failures: list[ScrapeFailure] = None):
+    # Two API requests per 50 missions: their wikitext, then all their
+    # infobox templates rendered at once. Pages the API can't do, e.g.
+    # because their infobox isn't the usual template, go through the
+    # rendered article as before.
+    fallback = []
+    for batch in _chunked(mission_links, max_titles_per_request):
+        try:
+            pages = query_wikitext([ mission_title for _, mission_title in batch ], session=session, refresh=refresh)
+        except (requests.RequestException, ValueError) as e:
+            print(f'Wikitext query failed, using the articles instead: {e!r}', file=sys.stderr)
+            pages = {}
+
+        templates = {}
+        for mission_url, mission_title in batch:
+            href = urllib.parse.urlparse(mission_url).path
+            revision_id, wikitext = pages.get(mission_title, (None, None))
+            template = find_template(wikitext) if wikitext is not None else None
+            if template is None:
+                fallback.append((mission_url, mission_title))
+                continue
+            stored = store.get(href) if store is not None and not refresh else None
+            if stored is not None and stored.revision_id == revision_id and stored.record is not None:
+                yield (mission_url, mission_title, stored.record)
+                continue
+            templates[mission_title] = (mission_url, revision_id, wikitext, standalone_template(template, mission_title))
+
+        infoboxes = {}
+        if templates:
+            try:
+                infoboxes = find_batch_infoboxes(render_templates({ title: template for title, (*_, template) in templates.items() },
+                                                                  session=session))
+            except (requests.RequestException, ValueError) as e:
+                print(f'Rendering infoboxes failed, using the articles instead: {e!r}', file=sys.stderr)
+        for mission_title, (mission_url, revision_id, wikitext, _) in templates.items():
+            info_box = infoboxes.get(mission_title)
+            if info_box is None:
+                fallback.append((mission_url, mission_title))
+                continue
+            try:
+                record = extract_mission_record(mission_url, info_box)
+            except Exception as e:
+                print(f"Extracting '{mission_title}' from its rendered template failed, using the article instead: {e!r}",
+                      file=sys.stderr)
+                fallback.append((mission_url, mission_title))
                 continue
-            if log:
-                try:
-                    #print(f'{mission!r} "{mission.name}"')
-                    print(mission.details())
-                except:
-                    print(f'{traceback.format_exc()}{mission!r}:\n{mission._info_box}', file=sys.stderr)
-            yield (tasks[task], mission)
+            if store is not None:
+                store.put(urllib.parse.urlparse(mission_url).path, mission_title, record, revision_id,
+                          content_hash(wikitext.encode('utf8')))
+            yield (mission_url, mission_title, record)
+    if store is not None:
+        store.commit()
+    if fallback:
+        yield from _scrape_mission_records_concurrent(fallback, max_workers=max_workers, chunksize=chunksize,
+                                                      refresh=refresh, store=store, checkpoint=checkpoint,
+                                                      retries=retries, failures=failures)
+
+def scrape_all_missions_api(slice_=slice(None), *, max_workers=5, chunksize=8, refresh=False, store: MissionStore = None,
+                            checkpoint: ScrapeCheckpoint = None, retries=2, failures: list[ScrapeFailure] = None, log=False):
+    mission_links = scrape_subcategory_page_links(missions_category_url)
+    for mission_url, mission_title, record in _scrape_mission_records_api(
+            [*mission_links.items()][slice_], max_workers=max_workers, chunksize=chunksize, refresh=refresh, store=store,
+            checkpoint=checkpoint, retries=retries, failures=failures):
+        if record is None:
+            continue
+        mission = Mission(mission_url, record=record)
+        if log:
+            _log_mission(mission)
+        yield (mission_title, mission)
 
 if __name__ == '__main__':
     scrape_all_missions(log=True)
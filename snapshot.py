@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterable, NamedTuple
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import requote_uri
+
+default_snapshot_path = 'xcx_missions.snapshot'
+wiki_origin = 'https://xenoblade.fandom.com'
+
+class SnapshotPage(NamedTuple):
+    url: str
+    status_code: int
+    reason: str
+    headers: dict[str, str]
+    content: bytes
+
+def normalize_url(url: str):
+    # Wiki links are not consistent about which path characters they escape
+    # (e.g. ' vs %27), so paths are compared in a canonical quoting
+    parts = urllib.parse.urlsplit(requote_uri(url))
+    path = urllib.parse.quote(urllib.parse.unquote(parts.path), safe="/:@!$&'()*+,;=-._~")
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc, path, parts.query, ''))
+
+class Snapshot:
+    def __init__(self, path=default_snapshot_path, *, create=False):
+        if not create and not os.path.exists(path):
+            raise FileNotFoundError(f"snapshot '{path}' does not exist")
+        self.path = path
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        if create:
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    status_code INTEGER NOT NULL,
+                    reason TEXT NOT NULL,
+                    headers TEXT NOT NULL,
+                    content BLOB NOT NULL
+                )
+            ''')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS aliases (
+                    url TEXT PRIMARY KEY,
+                    target TEXT NOT NULL
+                )
+            ''')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+    def add(self, page: SnapshotPage, aliases: Iterable[str] = ()):
+        url = normalize_url(page.url)
+        self._connection.execute(
+            'INSERT OR REPLACE INTO pages (url, status_code, reason, headers, content) VALUES (?, ?, ?, ?, ?)',
+            (url, page.status_code, page.reason, json.dumps(page.headers), zlib.compress(page.content, 9))
+        )
+        for alias in aliases:
+            if normalize_url(alias) != url:
+                self._connection.execute('INSERT OR REPLACE INTO aliases (url, target) VALUES (?, ?)',
+                                         (normalize_url(alias), url))
+
+    def get(self, url: str) -> SnapshotPage | None:
+        url = normalize_url(url)
+        with self._lock:
+            if self._pid != os.getpid():
+                # SQLite connections must not be shared with forked pool workers
+                self._pid = os.getpid()
+                self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            alias = self._connection.execute('SELECT target FROM aliases WHERE url = ?', (url,)).fetchone()
+            if alias is not None:
+                url = alias[0]
+            row = self._connection.execute(
+                'SELECT url, status_code, reason, headers, content FROM pages WHERE url = ?', (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        url, status_code, reason, headers, content = row
+        return SnapshotPage(url, status_code, reason, json.loads(headers), zlib.decompress(content))
+
+    def urls(self) -> list[str]:
+        return [ url for url, in self._connection.execute('SELECT url FROM pages ORDER BY url') ]
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+def export_snapshot(path: str, cache_path='.requests_cache'):
+    # Every successful response in the scraper's HTTP cache is copied, which
+    # covers the category listings and mission pages of previous runs.
+    import requests_cache
+    cache = requests_cache.CachedSession(cache_path).cache
+    count = 0
+    with Snapshot(path, create=True) as snapshot:
+        for response in cache.responses.values():
+            if not response.url.startswith(wiki_origin + '/') or response.status_code != 200:
+                continue
+            headers = { key: value for key, value in response.headers.items()
+                        if key.lower() not in ('content-encoding', 'content-length', 'transfer-encoding') }
+            snapshot.add(
+                SnapshotPage(response.url, response.status_code, response.reason or 'OK', headers, response.content),
+                aliases=[ redirect.url for redirect in response.history ],
+            )
+            count += 1
+    return count
+
+class ReplaySession(requests.Session):
+    # Serves responses from a snapshot instead of the network. Unknown URLs
+    # get a 404 so they fail the same way a missing wiki page would.
+    def __init__(self, path=default_snapshot_path):
+        super().__init__()
+        self.snapshot = Snapshot(path)
+
+    def request(self, method, url, params=None, *args, force_refresh=False, refresh=False, **kwargs):
+        url = requests.Request(method, url, params=params).prepare().url
+        page = self.snapshot.get(url)
+        response = requests.Response()
+        response.url = url
+        response.request = requests.Request(method, url).prepare()
+        if page is None:
+            response.status_code = 404
+            response.reason = 'Not Found'
+            response._content = b''
+        else:
+            response.status_code = page.status_code
+            response.reason = page.reason
+            response.headers = CaseInsensitiveDict(page.headers)
+            response._content = page.content
+        return response
+
+def serve_snapshot(path=default_snapshot_path, host='127.0.0.1', port=8000, latency=0.0):
+    # A local stand-in for the wiki, e.g. for asyncfandom.AsyncFetcher(base_url=...).
+    # latency is added to every response, in seconds, to imitate the network.
+    snapshot = Snapshot(path)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            page = snapshot.get(wiki_origin + self.path)
+            if page is None:
+                self.send_error(404)
+                return
+            self.send_response(page.status_code, page.reason)
+            content_type = CaseInsensitiveDict(page.headers).get('content-type', 'text/html; charset=UTF-8')
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(page.content)))
+            self.end_headers()
+            self.wfile.write(page.content)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    return server
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Offline snapshots of the wiki pages used by the scraper')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help='copy the pages in the HTTP cache into a snapshot')
+    export.add_argument('snapshot', nargs='?', default=default_snapshot_path)
+    export.add_argument('--cache', default='.requests_cache', help='requests_cache database to export from')
+
+    info = commands.add_parser('info', help='list the pages in a snapshot')
+    info.add_argument('snapshot', nargs='?', default=default_snapshot_path)
+
+    serve = commands.add_parser('serve', help='serve a snapshot over HTTP as a stand-in for the wiki')
+    serve.add_argument('snapshot', nargs='?', default=default_snapshot_path)
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8000)
+    serve.add_argument('--latency-ms', type=float, default=0, help='delay every response by this much')
+
+    args = parser.parse_args(argv)
+    if args.command == 'export':
+        count = export_snapshot(args.snapshot, args.cache)
+        print(f"Exported {count} pages to '{args.snapshot}' ({os.path.getsize(args.snapshot) / 2**20:.1f} MB)")
+    elif args.command == 'info':
+        with Snapshot(args.snapshot) as snapshot:
+            for url in snapshot.urls():
+                print(url)
+            print(f'{len(snapshot)} pages', file=sys.stderr)
+    elif args.command == 'serve':
+        server = serve_snapshot(args.snapshot, args.host, args.port, args.latency_ms / 1000)
+        print(f"Serving '{args.snapshot}' on http://{args.host}:{args.port}/", file=sys.stderr)
+        server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import pytest
+
+# The modules live at the top of the repository, not in a package
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from snapshot import Snapshot, SnapshotPage, wiki_origin
+
+data = pathlib.Path(__file__).with_name('data')
+
+def pytest_sessionstart(session):
+    # Importing scrapefandom opens the HTTP cache in the working directory,
+    # which would otherwise be the repository. This runs before the test
+    # modules are collected and import it.
+    session.config.original_cwd = os.getcwd()
+    session.config.workdir = tempfile.mkdtemp(prefix='xcx-tests-')
+    os.chdir(session.config.workdir)
+
+def pytest_sessionfinish(session):
+    os.chdir(session.config.original_cwd)
+    shutil.rmtree(session.config.workdir, ignore_errors=True)
+
+def category_page(links: dict[str, str]):
+    members = ''.join(f'<a class="category-page__member-link" href="{href}" title="{title}">{title}</a>'
+                      for href, title in links.items())
+    return f'<!DOCTYPE html><html><body>{members}</body></html>'.encode()
+
+def page(url: str, content: bytes):
+    return SnapshotPage(wiki_origin + url, 200, 'OK', { 'content-type': 'text/html; charset=UTF-8' }, content)
+
+@pytest.fixture
+def wiki_snapshot(tmp_path):
+    # The missions category holds one subcategory with two missions and a
+    # link to a page that doesn't exist
+    path = str(tmp_path / 'wiki.snapshot')
+    with Snapshot(path, create=True) as snapshot:
+        snapshot.add(page('/wiki/Category:XCX_Missions', category_page({
+            '/wiki/Category:XCX_Normal_Missions': 'Category:XCX Normal Missions',
+        })))
+        snapshot.add(page('/wiki/Category:XCX_Normal_Missions', category_page({
+            "/wiki/Elma's_Task_A": "Elma's Task A",
+            '/wiki/Material_Hunt_A': 'Material Hunt A',
+            '/wiki/Missing_Mission': 'Missing Mission',
+        })))
+        snapshot.add(page("/wiki/Elma's_Task_A", (data / 'elmas_task_a.html').read_bytes()))
+        snapshot.add(page('/wiki/Material_Hunt_A', (data / 'material_hunt_a.html').read_bytes()))
+    return path
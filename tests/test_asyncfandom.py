@@ -0,0 +1,29 @@
+import threading
+import pytest
+
+from asyncfandom import iter_all_missions
+from snapshot import serve_snapshot
+
+@pytest.fixture
+def wiki(wiki_snapshot):
+    server = serve_snapshot(wiki_snapshot, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+def test_scrapes_missions_and_reports_failed_pages(wiki):
+    failures = []
+    missions = dict(iter_all_missions(failures=failures, base_url=wiki, retries=0))
+    assert sorted(missions) == ["Elma's Task A", 'Material Hunt A']
+    assert missions["Elma's Task A"].name == "Elma's Task A"
+    assert missions['Material Hunt A'].type is not None
+    assert [ failure.title for failure in failures ] == ['Missing Mission']
+    assert failures[0].error.startswith('ClientResponseError')
+
+def test_closing_stops_the_scrape(wiki):
+    missions = iter_all_missions(base_url=wiki, max_buffered=1)
+    next(missions)
+    missions.close()
+    assert not any(thread.name == 'asyncfandom' for thread in threading.enumerate())
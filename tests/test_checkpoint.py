@@ -0,0 +1,58 @@
+import subprocess
+import sys
+import pathlib
+
+import scrapefandom
+from checkpoint import ScrapeCheckpoint
+from conftest import data, page
+from missionstore import MissionStore
+from snapshot import ReplaySession, Snapshot
+
+missiongraph = pathlib.Path(__file__).resolve().parent.parent / 'missiongraph.py'
+
+def edit_elmas_task(snapshot_path: str):
+    content = (data / 'elmas_task_a.html').read_bytes().replace(b'to help Gwin train', b'to help Gwin and Doug train')
+    with Snapshot(snapshot_path, create=True) as snapshot:
+        snapshot.add(page("/wiki/Elma's_Task_A", content))
+
+def stored_summary(store_path: str):
+    with MissionStore(store_path, readonly=True) as store:
+        return store.get("/wiki/Elma's_Task_A").record.summary
+
+def test_rerun_after_a_permanent_failure_sees_edits(wiki_snapshot, tmp_path):
+    # Missing_Mission is a 404 on every run, that must not keep the other
+    # pages in the checkpoint and hide their edits from later runs
+    def run():
+        return subprocess.run([sys.executable, str(missiongraph), '--snapshot', wiki_snapshot, '--store', 'store.sqlite',
+                               '--retries', '0', '--viewer', 'viewer'],
+                              cwd=tmp_path, capture_output=True, text=True, check=True)
+
+    first = run()
+    assert '1 pages could not be scraped' in first.stderr
+    assert not (tmp_path / '.scrape_checkpoint.jsonl').exists()
+    assert stored_summary(str(tmp_path / 'store.sqlite')) == 'Defeat silver suids to help Gwin train.'
+
+    edit_elmas_task(wiki_snapshot)
+    second = run()
+    assert 'Resuming' not in second.stderr
+    assert stored_summary(str(tmp_path / 'store.sqlite')) == 'Defeat silver suids to help Gwin and Doug train.'
+
+def test_checkpoint_of_an_older_revision_is_not_resumed(wiki_snapshot, tmp_path, monkeypatch):
+    monkeypatch.setenv('XCX_SNAPSHOT', wiki_snapshot)
+    monkeypatch.setattr(scrapefandom, 'session', ReplaySession(wiki_snapshot))
+    links = [ ("/wiki/Elma's_Task_A", "Elma's Task A"), ('/wiki/Material_Hunt_A', 'Material Hunt A') ]
+    with ScrapeCheckpoint(str(tmp_path / 'checkpoint.jsonl')) as checkpoint:
+        list(scrapefandom._scrape_mission_records_concurrent(links, max_workers=1, checkpoint=checkpoint,
+                                                             revision_ids={ "Elma's Task A": 1, 'Material Hunt A': 1 }))
+
+    # Interrupted after the first run, then Elma's Task A was edited
+    edit_elmas_task(wiki_snapshot)
+    with ScrapeCheckpoint(str(tmp_path / 'checkpoint.jsonl')) as checkpoint, \
+         MissionStore(str(tmp_path / 'store.sqlite')) as store:
+        assert len(checkpoint) == 2
+        records = { title: record for _, title, record in scrapefandom._scrape_mission_records_concurrent(
+            links, max_workers=1, refresh=True, store=store, checkpoint=checkpoint,
+            revision_ids={ "Elma's Task A": 2, 'Material Hunt A': 1 }) }
+        assert records["Elma's Task A"].summary == 'Defeat silver suids to help Gwin and Doug train.'
+        assert records['Material Hunt A'] == checkpoint.get('/wiki/Material_Hunt_A').record
+        assert store.get("/wiki/Elma's_Task_A").revision_id == 2
@@ -0,0 +1,9 @@
+import pytest
+
+import scrapefandom
+
+@pytest.mark.parametrize('options', [ { 'max_in_flight': 0 }, { 'max_in_flight': -1 }, { 'chunksize': 0 } ])
+def test_rejects_settings_that_would_scrape_nothing(options):
+    missions = scrapefandom._scrape_mission_records_concurrent([ ('/wiki/Material_Hunt_A', 'Material Hunt A') ], **options)
+    with pytest.raises(ValueError):
+        next(missions)
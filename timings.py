@@ -0,0 +1,70 @@
+import contextlib
+import sys
+import time
+from collections import Counter, OrderedDict
+
+class Span:
+    __slots__ = ('name', 'calls', 'wall_s', 'cpu_s')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+
+class Timings:
+    def __init__(self):
+        self.spans: OrderedDict[str, Span] = OrderedDict()
+        self.counters: Counter[str] = Counter()
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            span = self.spans.get(name)
+            if span is None:
+                span = self.spans[name] = Span(name)
+            span.calls += 1
+            span.wall_s += time.perf_counter() - wall_start
+            span.cpu_s += time.process_time() - cpu_start
+
+    def count(self, name: str, amount=1):
+        self.counters[name] += amount
+
+    def merge_counters(self, counters: dict[str, int]):
+        self.counters.update(counters)
+
+    def reset(self):
+        self.spans.clear()
+        self.counters.clear()
+
+    def summary(self):
+        lines = [f'{"phase":<32} {"calls":>6} {"wall s":>9} {"cpu s":>9}']
+        for span in self.spans.values():
+            lines.append(f'{span.name:<32} {span.calls:>6} {span.wall_s:>9.3f} {span.cpu_s:>9.3f}')
+        if self.counters:
+            lines.append('')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{name:<32} {value:>6}')
+        return '\n'.join(lines)
+
+    def print_summary(self, file=sys.stderr):
+        print(self.summary(), file=file)
+
+# Process wide recorder, pool workers send their counters back to the parent
+timings = Timings()
+
+def count_cache_response(response):
+    # Only responses from a requests_cache session have from_cache
+    from_cache = getattr(response, 'from_cache', None)
+    if getattr(response, 'revalidated', False):
+        # Expired, but the wiki answered 304 Not Modified
+        timings.count('http_cache_revalidated')
+    elif from_cache is not None:
+        timings.count('http_cache_hits' if from_cache else 'http_cache_misses')
+    timings.count('http_requests')
+    timings.count('http_bytes', len(response.content))
+    return response
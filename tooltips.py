@@ -0,0 +1,105 @@
+import base64
+import gzip
+import html
+import json
+import re
+from pyvis.network import Network
+
+# Tooltips are split on tag boundaries, which is where the infobox markup
+# repeats between missions (classes, icons, section headers, ...)
+_fragment_pattern = re.compile(r'(<[^>]+>)')
+
+tooltip_script = '''
+        <script type="application/octet-stream" id="tooltip-data">{data}</script>
+        <script type="text/javascript">
+            (function () {{
+                var table = null;
+
+                function loadTooltips() {{
+                    if (table !== null) {{
+                        return table;
+                    }}
+                    var encoded = document.getElementById('tooltip-data').textContent;
+                    if (encoded) {{
+                        var bytes = Uint8Array.from(atob(encoded), function (c) {{ return c.charCodeAt(0); }});
+                        var stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+                        table = new Response(stream).json();
+                    }} else if (window.graphData) {{
+                        // The static viewer ships the table in its graph payload instead
+                        table = Promise.resolve(graphData.tooltips);
+                    }}
+                    return table;
+                }}
+
+                // Popups are assembled from the fragment table the first time
+                // an item is hovered, before vis-network's tooltip delay runs out
+                function setTitle(dataSet, id) {{
+                    var item = dataSet.get(id);
+                    if (item === null || item.tooltip == null) {{
+                        return;
+                    }}
+                    var loading = loadTooltips();
+                    if (loading === null) {{
+                        return;
+                    }}
+                    loading.then(function (table) {{
+                        var title = table.tooltips[item.tooltip].map(function (i) {{ return table.fragments[i]; }}).join('');
+                        dataSet.update({{ id: id, title: title, tooltip: null }});
+                    }});
+                }}
+
+                function watchHover() {{
+                    network.on('hoverNode', function (params) {{ setTitle(nodes, params.node); }});
+                    network.on('hoverEdge', function (params) {{ setTitle(edges, params.edge); }});
+                }}
+
+                if (network) {{
+                    watchHover();
+                }} else {{
+                    document.addEventListener('graphload', watchHover);
+                }}
+                window.addEventListener('load', function () {{
+                    (window.requestIdleCallback || setTimeout)(loadTooltips);
+                }});
+            }})();
+        </script>
+'''
+
+def _placeholder_title(node: dict):
+    # Shown until the table is decoded, or instead of it in browsers without
+    # DecompressionStream. Node titles must keep a link for pyvis to use its
+    # clickable popup instead of vis-network's tooltip.
+    return f'<a href="{html.escape(node["id"])}">{html.escape(str(node.get("label", node["id"])))}</a>'
+
+def compact_tooltips(net: Network):
+    # Replaces every 'title' in the network with a 'tooltip' index into a
+    # table of unique tooltips, each stored as a list of shared fragments.
+    fragments: dict[str, int] = {}
+    tooltips: dict[str, int] = {}
+    table = []
+    for item in [*net.nodes, *net.edges]:
+        title = item.pop('title', None)
+        if not isinstance(title, str):
+            continue
+        index = tooltips.get(title)
+        if index is None:
+            index = tooltips[title] = len(table)
+            table.append([ fragments.setdefault(part, len(fragments)) for part in _fragment_pattern.split(title) if part ])
+        item['tooltip'] = index
+    for node in net.nodes:
+        if 'tooltip' in node:
+            node['title'] = _placeholder_title(node)
+    return {
+        'fragments': [*fragments],
+        'tooltips': table,
+    }
+
+def decode_tooltips(data: str) -> dict:
+    return json.loads(gzip.decompress(base64.b64decode(data)))
+
+def encode_tooltips(table: dict):
+    data = json.dumps(table, separators=(',', ':')).encode()
+    return base64.b64encode(gzip.compress(data, 9, mtime=0)).decode('ascii')
+
+def render_tooltip_script(table: dict):
+    return tooltip_script.format(data=encode_tooltips(table))
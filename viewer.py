@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from tooltips import decode_tooltips
+
+manifest_name = 'graph.json'
+
+_nodes_pattern = re.compile(r'(nodes = new vis\.DataSet\()(.*?)(\);\n)')
+_edges_pattern = re.compile(r'(edges = new vis\.DataSet\()(.*?)(\);\n)')
+_options_pattern = re.compile(r'(var options = )(\{.*?\n\})(;)', re.DOTALL)
+_tooltip_data_pattern = re.compile(r'(<script type="application/octet-stream" id="tooltip-data">)([^<]*)(</script>)')
+
+# Replaces the drawGraph() call at the end of pyvis' script, the graph is
+# drawn once the manifest and the payload it points to have been fetched.
+# URLs are resolved against the page, not the Fandom <base href>.
+viewer_loader = '''var graphData;
+              fetch(new URL('{manifest}', location.href), {{ cache: 'no-cache' }})
+                  .then(function (response) {{ return response.json(); }})
+                  .then(function (manifest) {{ return fetch(new URL(manifest.payload, location.href)); }})
+                  .then(function (response) {{ return response.json(); }})
+                  .then(function (payload) {{
+                      graphData = payload;
+                      drawGraph();
+                      document.dispatchEvent(new Event('graphload'));
+                  }});
+'''
+
+def _dump_lines(items: list[dict]):
+    # One item per line, so consecutive payloads diff line by line
+    return '[\n' + ',\n'.join(json.dumps(item, sort_keys=True, ensure_ascii=False) for item in items) + '\n]'
+
+def split_html(html: str) -> tuple[str, dict]:
+    # Takes the data out of a page made by render_html, leaving a shell
+    # that only changes when pyvis, the template or the header do.
+    payload = {}
+    for key, pattern in [('nodes', _nodes_pattern), ('edges', _edges_pattern), ('options', _options_pattern)]:
+        match = pattern.search(html)
+        if match is None:
+            raise ValueError(f'could not find the {key} in the generated HTML')
+        payload[key] = json.loads(match.group(2))
+        html = html[:match.start(2)] + f'graphData.{key}' + html[match.end(2):]
+    tooltip_data = _tooltip_data_pattern.search(html)
+    if tooltip_data is not None:
+        payload['tooltips'] = decode_tooltips(tooltip_data.group(2))
+        html = html[:tooltip_data.start(2)] + html[tooltip_data.end(2):]
+    draw_call = html.rindex('drawGraph();')
+    html = html[:draw_call] + viewer_loader.format(manifest=manifest_name) + html[draw_call+len('drawGraph();'):]
+    payload['nodes'].sort(key=lambda node: node['id'])
+    payload['edges'].sort(key=lambda edge: (edge['from'], edge['to']))
+    return html, payload
+
+def encode_payload(payload: dict):
+    parts = [ f'"{key}": {_dump_lines(payload[key])}' for key in ['nodes', 'edges'] ]
+    parts += [ f'"{key}": {json.dumps(value, sort_keys=True, ensure_ascii=False)}'
+               for key, value in payload.items() if key not in ('nodes', 'edges') ]
+    return ('{\n' + ',\n'.join(parts) + '\n}\n').encode('utf8')
+
+def _write_if_changed(path: str, data: bytes):
+    # Unchanged files keep their mtime, and so their HTTP cache validators
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    with open(path, 'wb') as f:
+        f.write(data)
+    return True
+
+def _write_compressed(path: str, data: bytes):
+    # Precompressed siblings for servers that can send them as-is,
+    # e.g. nginx gzip_static/brotli_static
+    written = [ path ]
+    _write_if_changed(path, data)
+    _write_if_changed(path + '.gz', gzip.compress(data, 9, mtime=0))
+    written.append(path + '.gz')
+    if brotli is not None:
+        _write_if_changed(path + '.br', brotli.compress(data))
+        written.append(path + '.br')
+    return written
+
+def write_viewer(html: str, directory: str, *, keep_payloads=3):
+    # The payload name contains its hash, so it can be cached forever.
+    # Only the small manifest has to be revalidated on every visit.
+    os.makedirs(directory, exist_ok=True)
+    shell, payload = split_html(html)
+    data = encode_payload(payload)
+    version = hashlib.sha256(data).hexdigest()[:16]
+    payload_name = f'graph-{version}.json'
+
+    written = _write_compressed(os.path.join(directory, 'index.html'), shell.encode('utf8'))
+    written += _write_compressed(os.path.join(directory, payload_name), data)
+    manifest = json.dumps({ 'version': version, 'payload': payload_name }).encode('utf8')
+    _write_if_changed(os.path.join(directory, manifest_name), manifest)
+    written.append(os.path.join(directory, manifest_name))
+
+    # Old payloads are kept for a few builds, for visitors who fetched the
+    # manifest just before a rebuild
+    os.utime(os.path.join(directory, payload_name))
+    payloads = sorted([ entry for entry in os.scandir(directory)
+                        if re.fullmatch(r'graph-[0-9a-f]{16}\.json', entry.name) ],
+                      key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in payloads[keep_payloads:]:
+        for suffix in ['', '.gz', '.br']:
+            if os.path.exists(entry.path + suffix):
+                os.remove(entry.path + suffix)
+    return written
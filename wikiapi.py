@@ -0,0 +1,171 @@
+import html
+import re
+import urllib.parse
+import requests
+import requests_cache
+
+from timings import count_cache_response
+
+api_url = 'https://xenoblade.fandom.com/api.php'
+max_titles_per_request = 50
+# The template that renders the div.xcx.mission infobox
+mission_template_pattern = re.compile(r'(infobox[ _])?xcx[ _]mission', re.IGNORECASE)
+
+def title_from_href(href: str | bytes):
+    path = urllib.parse.urlparse(href).path
+    return urllib.parse.unquote(path.removeprefix('/wiki/')).replace('_', ' ')
+
+def _batched(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+def _query(session: requests.Session, params: dict, *, refresh=False):
+    if refresh and isinstance(session, requests_cache.CachedSession):
+        return session.get(api_url, timeout=10, params=params, force_refresh=True)
+    return session.get(api_url, timeout=10, params=params)
+
+def query_revision_ids(titles: list[str], *, session: requests.Session = None, refresh=True) -> dict[str, int]:
+    # Revision IDs are what decides whether a page is fetched again, so by
+    # default they bypass the HTTP cache
+    if session is None:
+        session = requests.Session()
+    revision_ids: dict[str, int] = {}
+    for batch in _batched([*dict.fromkeys(titles)], max_titles_per_request):
+        response = _query(session, refresh=refresh, params={
+            'action': 'query',
+            'prop': 'revisions',
+            'rvprop': 'ids',
+            'titles': '|'.join(batch),
+            'format': 'json',
+            'formatversion': 2,
+        })
+        count_cache_response(response)
+        response.raise_for_status()
+        query = response.json().get('query', {})
+        requested = _normalized_titles(query, batch)
+        for page in query.get('pages', []):
+            revisions = page.get('revisions')
+            if page.get('missing') or not revisions:
+                continue
+            revision_ids[requested.get(page['title'], page['title'])] = revisions[0]['revid']
+    return revision_ids
+
+def _normalized_titles(query: dict, batch: list[str]):
+    # Map the API's normalized titles back to the titles that were asked for
+    requested = { title: title for title in batch }
+    for normalized in query.get('normalized', []):
+        requested[normalized['to']] = normalized['from']
+    return requested
+
+def query_wikitext(titles: list[str], *, session: requests.Session = None, refresh=False) -> dict[str, tuple[int, str]]:
+    # Revision ID and wikitext of up to 50 pages per request, instead of
+    # one rendered article per page
+    if session is None:
+        session = requests.Session()
+    pages: dict[str, tuple[int, str]] = {}
+    for batch in _batched([*dict.fromkeys(titles)], max_titles_per_request):
+        response = _query(session, refresh=refresh, params={
+            'action': 'query',
+            'prop': 'revisions',
+            'rvprop': 'ids|content',
+            'rvslots': 'main',
+            'titles': '|'.join(batch),
+            'format': 'json',
+            'formatversion': 2,
+        })
+        count_cache_response(response)
+        response.raise_for_status()
+        query = response.json().get('query', {})
+        requested = _normalized_titles(query, batch)
+        for page in query.get('pages', []):
+            revisions = page.get('revisions')
+            if page.get('missing') or not revisions:
+                continue
+            content = revisions[0].get('slots', {}).get('main', {}).get('content')
+            if content is None:
+                continue
+            pages[requested.get(page['title'], page['title'])] = (revisions[0]['revid'], content)
+    return pages
+
+def _split_top_level(text: str, separator: str):
+    # Splits on separator wherever it isn't inside {{ }} or [[ ]]
+    parts, depth, start, i = [], 0, 0, 0
+    while i < len(text):
+        pair = text[i:i+2]
+        if pair in ('{{', '[['):
+            depth += 1
+            i += 2
+        elif pair in ('}}', ']]'):
+            depth -= 1
+            i += 2
+        else:
+            if depth == 0 and text[i] == separator:
+                parts.append(text[start:i])
+                start = i + 1
+            i += 1
+    parts.append(text[start:])
+    return parts
+
+def find_template(wikitext: str, pattern: re.Pattern = mission_template_pattern) -> str | None:
+    # The first top level {{...}} whose name matches pattern
+    depth, start, i = 0, 0, 0
+    while i < len(wikitext):
+        pair = wikitext[i:i+2]
+        if pair == '{{':
+            if depth == 0:
+                start = i
+            depth += 1
+            i += 2
+        elif pair == '}}' and depth:
+            depth -= 1
+            i += 2
+            if depth == 0:
+                template = wikitext[start:i]
+                name = _split_top_level(template[2:-2], '|')[0].strip()
+                if pattern.fullmatch(name.removeprefix('Template:')):
+                    return template
+        else:
+            i += 1
+    return None
+
+def template_parameters(template: str) -> dict[str, str]:
+    parameters = {}
+    for i, part in enumerate(_split_top_level(template[2:-2], '|')[1:], 1):
+        key, equals, value = part.partition('=')
+        if equals and '{{' not in key and '[[' not in key:
+            parameters[key.strip()] = value.strip()
+        else:
+            parameters[str(i)] = part.strip()
+    return parameters
+
+def standalone_template(template: str, title: str):
+    # Rendered away from its page the template can't fall back to
+    # {{PAGENAME}} for the mission's name, so it is passed explicitly
+    template = template.replace('{{PAGENAME}}', title)
+    if 'name' not in template_parameters(template):
+        template = template[:-2] + f'|name={title}}}}}'
+    return template
+
+def render_templates(templates: dict[str, str], *, session: requests.Session = None) -> str:
+    # Renders all the templates with a single parse request, each one inside
+    # a div whose data-batch-title says which page it came from
+    if session is None:
+        session = requests.Session()
+    text = '\n'.join(f'<div data-batch-title="{html.escape(title)}">\n{template}\n</div>'
+                     for title, template in templates.items())
+    response = session.post(api_url, timeout=30, data={
+        'action': 'parse',
+        'text': text,
+        'contentmodel': 'wikitext',
+        'prop': 'text',
+        'disablelimitreport': 1,
+        'disableeditsection': 1,
+        'format': 'json',
+        'formatversion': 2,
+    })
+    count_cache_response(response)
+    response.raise_for_status()
+    result = response.json()
+    if 'error' in result:
+        raise ValueError(f"parse request failed: {result['error'].get('info', result['error'])}")
+    return result['parse']['text']